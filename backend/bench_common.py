@@ -0,0 +1,88 @@
+"""Shared helpers for the bench_*.py scripts.
+
+Loads the synthetic receipts from data_gen/output/synthetic_receipts.jsonl,
+computes latency percentiles, scores extracted fields against each sample's
+ground truth, guards model-backed runs and writes results as JSON.
+"""
+import json
+import re
+import statistics
+from decimal import Decimal
+from pathlib import Path
+
+import main
+
+DATASET_PATH = Path(__file__).resolve().parent.parent / "data_gen" / "output" / "synthetic_receipts.jsonl"
+FIELDS = ("merchant", "date", "total_amount", "tax", "tax_rate", "currency")
+
+def load_samples(limit):
+    with open(DATASET_PATH, encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    return rows[:limit]
+
+def percentile(values, q):
+    # En yakın sıra yöntemi; boş ölçümde None
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[int(q * (len(ordered) - 1))]
+
+def percentile_ms(values, q, digits=3):
+    # Saniye cinsinden ölçümlerin yüzdeliği, milisaniye olarak
+    value = percentile(values, q)
+    return round(value * 1000, digits) if value is not None else None
+
+def summarize_ms(values):
+    return {
+        "count": len(values),
+        "mean_ms": round(statistics.mean(values) * 1000, 3) if values else None,
+        "p50_ms": percentile_ms(values, 0.50),
+        "p95_ms": percentile_ms(values, 0.95),
+        "p99_ms": percentile_ms(values, 0.99)
+    }
+
+def expected_fields(ground_truth):
+    tax = sum(Decimal(str(v)) for v in ground_truth["kdv_breakdown"].values())
+    return {
+        "merchant": ground_truth["market"],
+        "date": ground_truth["date"],
+        "total_amount": f"{ground_truth['total_amount']:.2f}",
+        "tax": tax.quantize(Decimal("0.01")),
+        "tax_rate": {int(rate.strip("%")) for rate in ground_truth["kdv_breakdown"]},
+        # Sentetik fişler Türkçe, sembol basılmıyor
+        "currency": "₺"
+    }
+
+def score(structured, ground_truth):
+    """Per-field correctness of build_structured_data output against a sample's ground truth."""
+    expected = expected_fields(ground_truth)
+    rates = {int(rate) for rate in re.findall(r"\d+", structured.get("tax_rate") or "")}
+    try:
+        tax_ok = abs(Decimal(structured["tax"]) - expected["tax"]) <= Decimal("0.01")
+    except ArithmeticError:
+        tax_ok = False
+    return {
+        "merchant": structured["merchant"].strip().upper() == expected["merchant"],
+        "date": structured["date"] == expected["date"],
+        "total_amount": structured["total_amount"] == expected["total_amount"],
+        "tax": tax_ok,
+        "tax_rate": rates == expected["tax_rate"],
+        "currency": structured["currency"] == expected["currency"]
+    }
+
+def accuracy(scores):
+    """Field accuracy and exact-match rate over a list of score() results."""
+    return {
+        "accuracy": {field: round(sum(s[field] for s in scores) / len(scores), 4) for field in FIELDS},
+        "exact_match": round(sum(all(s.values()) for s in scores) / len(scores), 4)
+    }
+
+def require_model():
+    main.load_model()
+    if main.model_state["status"] != "ready":
+        raise SystemExit("HATA: Model yüklenemedi, benchmark çalıştırılamaz.")
+
+def write_output(path, results):
+    if path:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
@@ -0,0 +1,113 @@
+"""OCR text compaction benchmark.
+
+Builds prompts from the OCR text of the synthetic receipts in
+data_gen/output/synthetic_receipts.jsonl with compaction off and on and
+reports prompt tokens per request and, unless --tokens-only is given, LLM
+latency. The synthetic receipts are short; --item-repeat N repeats each item
+block N times to imitate long supermarket receipts. Needs the GGUF model at
+main.MODEL_PATH (with --tokens-only only its vocabulary is loaded).
+--check-totals needs no model: it only verifies that the line holding each
+sample's ground-truth total survives compaction and exits 1 if one is dropped.
+
+Usage (from the backend directory):
+    python bench_compaction.py --samples 50 --item-repeat 6
+    python bench_compaction.py --tokens-only --item-repeat 20
+    python bench_compaction.py --check-totals --samples 100 --item-repeat 8
+"""
+import argparse
+import json
+import re
+import statistics
+import time
+
+import main
+from bench_common import load_samples, percentile, require_model, write_output
+
+def lengthen(text, repeat):
+    # Ayraçlar arasındaki kalem bloğunu çoğalt
+    lines = text.splitlines()
+    separators = [i for i, line in enumerate(lines) if line.count("-") > 10]
+    if repeat <= 1 or len(separators) < 2:
+        return text
+    start, end = separators[0] + 1, separators[1]
+    return "\n".join(lines[:start] + lines[start:end] * repeat + lines[end:])
+
+def total_line(text, total):
+    # Toplam tutarı taşıyan son satır; OCR tutarı bozduysa None
+    wanted = f"{total:.2f}"
+    lines = [re.sub(r"\s+", " ", line).strip() for line in text.splitlines()]
+    return next((line for line in reversed(lines) if wanted in line.replace(",", ".")), None)
+
+def check_totals(samples, repeat):
+    checked = 0
+    dropped = []
+    for sample in samples:
+        text = lengthen(sample["ocr_text"], repeat)
+        total = sample["ground_truth"]["total_amount"]
+        line = total_line(text, total)
+        if line is None:
+            continue
+        checked += 1
+        if total_line(main.compact_ocr_text(text), total) is None:
+            dropped.append(line)
+    return {"item_repeat": repeat, "checked": checked, "dropped": len(dropped), "dropped_lines": dropped[:10]}
+
+def run(texts, compact, tokens_only):
+    main.OCR_COMPACT = compact
+    prompt_tokens = []
+    truncated = 0
+    timings = []
+    for text in texts:
+        llm_input, _, was_truncated = main.prepare_llm_input(text)
+        truncated += was_truncated
+        prompt = main.build_prompt(llm_input)
+        prompt_tokens.append(len(main.llm.tokenize(prompt.encode("utf-8"), add_bos=True, special=True)))
+        if not tokens_only:
+            start = time.perf_counter()
+            main.process_with_llm(text)
+            timings.append(time.perf_counter() - start)
+    result = {
+        "compact": compact,
+        "samples": len(texts),
+        "prompt_tokens_mean": round(statistics.mean(prompt_tokens), 1),
+        "prompt_tokens_max": max(prompt_tokens),
+        "truncated": truncated
+    }
+    if timings:
+        result["llm_seconds_mean"] = round(statistics.mean(timings), 4)
+        result["llm_seconds_p95"] = round(percentile(timings, 0.95), 4)
+    return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark prompt size and latency with and without OCR compaction")
+    parser.add_argument("--samples", type=int, default=50)
+    parser.add_argument("--item-repeat", type=int, default=1, help="Repeat each receipt's item block N times")
+    parser.add_argument("--tokens-only", action="store_true", help="Only count prompt tokens (loads the vocabulary, not the weights)")
+    parser.add_argument("--check-totals", action="store_true", help="Only check that the total line survives compaction")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    if args.check_totals:
+        result = check_totals(load_samples(args.samples), args.item_repeat)
+        print(json.dumps(result, ensure_ascii=False))
+        if result["dropped"]:
+            raise SystemExit(1)
+        raise SystemExit(0)
+
+    main.extraction_log.enabled = False
+    if args.tokens_only:
+        if main.Llama is None:
+            raise SystemExit("HATA: llama-cpp-python yüklü değil, benchmark çalıştırılamaz.")
+        main.llm = main.Llama(model_path=main.MODEL_PATH, vocab_only=True, verbose=False)
+        template_tokens = len(main.llm.tokenize((main.PROMPT_PREFIX + main.PROMPT_SUFFIX).encode("utf-8"), add_bos=True, special=True))
+        main.ocr_token_budget = main.LLM_N_CTX - main.LLM_MAX_TOKENS - template_tokens
+    else:
+        require_model()
+
+    texts = [lengthen(sample["ocr_text"], args.item_repeat) for sample in load_samples(args.samples)]
+    results = [run(texts, compact, args.tokens_only) for compact in (False, True)]
+    if main.llm_scheduler is not None:
+        main.llm_scheduler.stop()
+    for result in results:
+        print(json.dumps(result))
+    write_output(args.output, results)
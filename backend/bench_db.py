@@ -0,0 +1,126 @@
+"""SQLite concurrency benchmark: per-request connections vs. the WAL pool.
+
+Runs a mixed workload (paginated reads of the receipts list plus inserts) from
+several threads against two fresh databases: one accessed the old way (a new
+rollback-journal connection per operation) and one through main.ConnectionPool.
+Reports throughput, read/write latency percentiles and lock errors.
+
+Usage (from the backend directory):
+    python bench_db.py --threads 8 --seconds 10 --write-ratio 0.2
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import main
+from bench_common import percentile_ms, write_output
+
+READ_SQL = "SELECT id, merchant, date, total, category FROM receipts ORDER BY created_at DESC, id DESC LIMIT 50"
+WRITE_SQL = """
+    INSERT INTO receipts (id, filename, merchant, date, total, tax, category, tax_rate, currency, status, image_url, total_minor, tax_minor, date_iso)
+    VALUES (?, '', ?, '01.01.2024', '10.00', '1.00', 'Grocery', '%10', '₺', 'Tamamlandı', '', 1000, 100, '2024-01-01')
+"""
+
+def prepare_db(path, rows):
+    # main.init_db ile aynı şema; DB_PATH geçici olarak yönlendirilir
+    original = main.DB_PATH
+    main.DB_PATH = path
+    try:
+        main.init_db()
+    finally:
+        main.DB_PATH = original
+    conn = sqlite3.connect(path)
+    conn.executemany(WRITE_SQL, [(str(uuid.uuid4()), f"Merchant {i % 50}") for i in range(rows)])
+    conn.commit()
+    conn.close()
+
+def per_request_connections(path):
+    @contextmanager
+    def connection():
+        conn = sqlite3.connect(path, timeout=main.DB_BUSY_TIMEOUT_MS / 1000)
+        try:
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+    return connection
+
+def run_workload(connection, threads, seconds, write_ratio):
+    reads, writes, errors = [], [], []
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+
+    def worker(seed):
+        rng = random.Random(seed)
+        local_reads, local_writes, local_errors = [], [], 0
+        while time.monotonic() < deadline:
+            is_write = rng.random() < write_ratio
+            start = time.perf_counter()
+            try:
+                with connection() as conn:
+                    if is_write:
+                        conn.execute(WRITE_SQL, (str(uuid.uuid4()), "Bench"))
+                    else:
+                        conn.execute(READ_SQL).fetchall()
+            except sqlite3.OperationalError:
+                local_errors += 1
+                continue
+            (local_writes if is_write else local_reads).append(time.perf_counter() - start)
+        with lock:
+            reads.extend(local_reads)
+            writes.extend(local_writes)
+            errors.append(local_errors)
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+
+    return {
+        "ops_per_second": round((len(reads) + len(writes)) / seconds, 1),
+        "reads": len(reads),
+        "writes": len(writes),
+        "lock_errors": sum(errors),
+        "read_ms_p50": percentile_ms(reads, 0.50),
+        "read_ms_p95": percentile_ms(reads, 0.95),
+        "write_ms_p50": percentile_ms(writes, 0.50),
+        "write_ms_p95": percentile_ms(writes, 0.95),
+        "read_ms_mean": round(statistics.mean(reads) * 1000, 3) if reads else None
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark mixed SQLite reads/writes")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--write-ratio", type=float, default=0.2)
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        baseline_path = os.path.join(tmp, "baseline.db")
+        pooled_path = os.path.join(tmp, "pooled.db")
+        prepare_db(baseline_path, args.rows)
+        prepare_db(pooled_path, args.rows)
+
+        baseline = run_workload(per_request_connections(baseline_path), args.threads, args.seconds, args.write_ratio)
+        results.append({"mode": "connect-per-request", **baseline})
+
+        pool = main.ConnectionPool(pooled_path, size=args.threads)
+        pooled = run_workload(pool.connection, args.threads, args.seconds, args.write_ratio)
+        pool.close()
+        results.append({"mode": "wal-pool", **pooled})
+
+    for result in results:
+        print(json.dumps(result))
+    write_output(args.output, results)
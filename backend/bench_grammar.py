@@ -0,0 +1,61 @@
+"""Grammar-constrained decoding benchmark.
+
+Runs the LLM extraction over the (noisy) OCR text of the synthetic receipts in
+data_gen/output/synthetic_receipts.jsonl with the JSON grammar off and on, and
+reports completion tokens per request, LLM latency, parse failures (requests
+that ended in the "Bilinmiyor" fallback) and per-field accuracy against the
+ground truth. Needs the GGUF model at main.MODEL_PATH.
+
+Usage (from the backend directory):
+    python bench_grammar.py --samples 50
+"""
+import argparse
+import json
+import statistics
+import time
+
+import main
+from bench_common import accuracy, load_samples, percentile, require_model, score, write_output
+
+def run(samples, grammar):
+    main.extraction_grammar = grammar
+    scheduler = main.llm_scheduler
+    tokens_before = scheduler.stats["completion_tokens"]
+    timings = []
+    failures = 0
+    scores = []
+    for sample in samples:
+        start = time.perf_counter()
+        data = main.process_with_llm(sample["ocr_text"])
+        timings.append(time.perf_counter() - start)
+        if data == main.FALLBACK_LLM_RESULT:
+            failures += 1
+        scores.append(score(main.build_structured_data(data), sample["ground_truth"]))
+    completion_tokens = scheduler.stats["completion_tokens"] - tokens_before
+    return {
+        "grammar": grammar is not None,
+        "samples": len(samples),
+        "completion_tokens_mean": round(completion_tokens / len(samples), 2),
+        "llm_seconds_mean": round(statistics.mean(timings), 4),
+        "llm_seconds_p95": round(percentile(timings, 0.95), 4),
+        "parse_failures": failures,
+        **accuracy(scores)
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark LLM extraction with and without the JSON grammar")
+    parser.add_argument("--samples", type=int, default=50)
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    # Kayıt dosyası benchmark çıktısıyla dolmasın
+    main.extraction_log.enabled = False
+    require_model()
+    grammar = main.extraction_grammar or main.LlamaGrammar.from_string(main.EXTRACTION_GRAMMAR, verbose=False)
+
+    samples = load_samples(args.samples)
+    results = [run(samples, None), run(samples, grammar)]
+    main.llm_scheduler.stop()
+    for result in results:
+        print(json.dumps(result))
+    write_output(args.output, results)
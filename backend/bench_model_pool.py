@@ -0,0 +1,81 @@
+"""Model pool sweep benchmark.
+
+For every combination of instance count and threads per instance (skipping
+those that oversubscribe the CPU), loads the model pool through
+main.load_model and sends the synthetic receipts' OCR text to
+process_with_llm from --concurrency client threads. Reports requests per
+second and per-request latency percentiles. Needs the GGUF model at
+main.MODEL_PATH.
+
+Usage (from the backend directory):
+    python bench_model_pool.py --instances 1 2 4 --threads 2 4 8 --concurrency 8
+"""
+import argparse
+import gc
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import main
+from bench_common import load_samples, percentile, require_model, write_output
+
+def timed_extraction(text):
+    start = time.perf_counter()
+    main.process_with_llm(text)
+    return time.perf_counter() - start
+
+def run(texts, instances, threads, concurrency, pin):
+    main.LLM_INSTANCES = instances
+    main.LLM_THREADS_PER_INSTANCE = threads
+    main.LLM_PIN_CORES = pin
+    require_model()
+    # Isınma: önek önbelleği ve ilk eval maliyeti ölçüme girmesin
+    for _ in range(instances):
+        main.process_with_llm(texts[0])
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        latencies = list(executor.map(timed_extraction, texts))
+    elapsed = time.perf_counter() - start
+
+    main.llm_scheduler.stop()
+    main.llm_scheduler = None
+    main.llm = None
+    gc.collect()
+    return {
+        "instances": instances,
+        "threads_per_instance": threads,
+        "pinned": pin,
+        "requests": len(texts),
+        "requests_per_second": round(len(texts) / elapsed, 3),
+        "latency_p50": round(percentile(latencies, 0.50), 4),
+        "latency_p95": round(percentile(latencies, 0.95), 4)
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep model instances x threads per instance")
+    parser.add_argument("--instances", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--threads", type=int, nargs="+", default=[2, 4, 8])
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--samples", type=int, default=40)
+    parser.add_argument("--pin", action="store_true", help="Pin each instance to its own cores")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    if main.Llama is None or not os.path.exists(main.MODEL_PATH):
+        raise SystemExit("HATA: llama-cpp-python veya model dosyası yok, benchmark çalıştırılamaz.")
+
+    main.extraction_log.enabled = False
+    cpu_count = os.cpu_count() or 1
+    texts = [sample["ocr_text"] for sample in load_samples(args.samples)]
+    results = []
+    for instances in args.instances:
+        for threads in args.threads:
+            if instances * threads > cpu_count:
+                continue
+            result = run(texts, instances, threads, args.concurrency, args.pin)
+            print(json.dumps(result))
+            results.append(result)
+
+    write_output(args.output, results)
@@ -0,0 +1,63 @@
+"""OCR backend micro-benchmark.
+
+Measures per-image OCR latency for each available backend (pytesseract's
+subprocess-per-call path and the persistent tesserocr engine) on preprocessed
+renders of the synthetic receipts.
+
+Usage (from the backend directory):
+    python bench_ocr.py --samples 30 --repeat 3
+"""
+import argparse
+import json
+import statistics
+import time
+
+import main
+from bench_common import load_samples, percentile_ms, write_output
+from bench_preprocess import render_receipt
+
+def bench_backend(backend, images, repeat):
+    # İlk çağrı (model yükleme) ölçüme dahil edilmez
+    backend.image_to_string(images[0])
+    latencies = []
+    for _ in range(repeat):
+        for image in images:
+            start = time.perf_counter()
+            backend.image_to_string(image)
+            latencies.append(time.perf_counter() - start)
+    return {
+        "backend": backend.name,
+        "images": len(latencies),
+        "latency_ms_mean": round(statistics.mean(latencies) * 1000, 2),
+        "latency_ms_p50": percentile_ms(latencies, 0.50, digits=2),
+        "latency_ms_p95": percentile_ms(latencies, 0.95, digits=2)
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark OCR backends")
+    parser.add_argument("--samples", type=int, default=30)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--width", type=int, default=3024)
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    images = [main.preprocess_image(render_receipt(s["raw_text"], args.width)) for s in load_samples(args.samples)]
+
+    backends = [main.PytesseractBackend()]
+    if main.tesserocr is not None:
+        backends.append(main.TesserocrBackend())
+    else:
+        print("UYARI: tesserocr yüklü değil, sadece pytesseract ölçülecek.")
+
+    results = []
+    for backend in backends:
+        try:
+            results.append(bench_backend(backend, images, args.repeat))
+        except main.pytesseract.TesseractNotFoundError:
+            print("HATA: Tesseract bulunamadı, pytesseract ölçülemedi.")
+        finally:
+            backend.close()
+
+    for result in results:
+        print(json.dumps(result))
+    write_output(args.output, results)
@@ -0,0 +1,187 @@
+"""End-to-end extraction benchmark.
+
+Replays the OCR text of data_gen/output/synthetic_receipts.jsonl through the
+extraction pipeline (process_with_llm, which compacts the OCR text, and the
+clean_amount/clean_currency post-processing in build_structured_data) and
+scores the result against each sample's ground truth. Reports per-stage
+latency percentiles (compaction is also timed in a separate pass outside
+the total), throughput, LLM tokens per second and field-level
+accuracy, and writes everything as JSON so two runs can be compared.
+
+--model uses the real GGUF model at main.MODEL_PATH. --stub uses a
+deterministic local stand-in that answers from the OCR text with the
+rule-based extractor and optionally sleeps per generated token, which is
+enough to track pipeline overhead and accuracy of the non-LLM stages.
+--path pipeline goes through extract_fields, i.e. includes the rule-based
+fast path, instead of calling process_with_llm for every sample.
+
+Usage (from the backend directory):
+    python bench_pipeline.py --stub --output stub.json
+    python bench_pipeline.py --model --path pipeline --output after.json --compare before.json
+"""
+import argparse
+import datetime
+import json
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import main
+from bench_common import accuracy, load_samples, require_model, score, summarize_ms, write_output
+
+# Bu oranların altına düşen doğruluk veya üstüne çıkan gecikme regresyon sayılır
+ACCURACY_TOLERANCE = 0.01
+LATENCY_TOLERANCE = 0.10
+
+class StubLlama:
+    """Deterministic stand-in for llama_cpp.Llama used by --stub runs."""
+
+    def __init__(self, seconds_per_token=0.0):
+        self.seconds_per_token = seconds_per_token
+        self.draft_model = None
+
+    def tokenize(self, text, add_bos=True, special=False):
+        return text.decode("utf-8").split()
+
+    def __call__(self, prompt, **kwargs):
+        ocr_text = prompt[len(main.PROMPT_PREFIX):len(prompt) - len(main.PROMPT_SUFFIX)]
+        data, _ = main.rule_based_extract(ocr_text)
+        text = json.dumps(data, ensure_ascii=False, indent=2)
+        completion_tokens = len(self.tokenize(text.encode("utf-8")))
+        time.sleep(self.seconds_per_token * completion_tokens)
+        return {
+            "choices": [{"text": text}],
+            "usage": {"prompt_tokens": len(self.tokenize(prompt.encode("utf-8"))), "completion_tokens": completion_tokens}
+        }
+
+def install_stub(seconds_per_token):
+    stub = StubLlama(seconds_per_token)
+    main.llm = stub
+    main.llm_scheduler = main.LLMPool([main.LLMScheduler(stub, name="llm-scheduler-stub")])
+    template_tokens = len(stub.tokenize((main.PROMPT_PREFIX + main.PROMPT_SUFFIX).encode("utf-8")))
+    main.ocr_token_budget = main.LLM_N_CTX - main.LLM_MAX_TOKENS - template_tokens
+    main.model_state.update(status="ready", instances=1)
+
+def run_sample(sample, path):
+    timings = {}
+    start = time.perf_counter()
+    if path == "pipeline":
+        data, used = main.extract_fields(sample["ocr_text"])
+    else:
+        data, used = main.process_with_llm(sample["ocr_text"]), "llm"
+    timings["extract_" + used] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    structured = main.build_structured_data(data)
+    timings["postprocess"] = time.perf_counter() - start
+    timings["total"] = sum(timings.values())
+    return timings, used, score(structured, sample["ground_truth"])
+
+def compaction_timings(samples):
+    # Sıkıştırma extract_* içinde zaten çalışır; bu ayrı geçiş sadece payını gösterir,
+    # total ve throughput ölçümüne girmez
+    timings = []
+    for sample in samples:
+        start = time.perf_counter()
+        main.compact_ocr_text(sample["ocr_text"])
+        timings.append(time.perf_counter() - start)
+    return timings
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(samples, path, concurrency):
+    main.text_cache.clear()
+    tokens_before = main.llm_scheduler.stats["completion_tokens"]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        outcomes = list(executor.map(lambda sample: run_sample(sample, path), samples))
+    elapsed = time.perf_counter() - start
+    completion_tokens = main.llm_scheduler.stats["completion_tokens"] - tokens_before
+
+    stages = {"compact": compaction_timings(samples)}
+    paths = {}
+    for timings, used, _ in outcomes:
+        for stage, seconds in timings.items():
+            stages.setdefault(stage, []).append(seconds)
+        paths[used] = paths.get(used, 0) + 1
+    llm_seconds = sum(stages.get("extract_llm", []))
+    return {
+        "stages": {stage: summarize_ms(values) for stage, values in stages.items()},
+        "throughput_rps": round(len(samples) / elapsed, 3),
+        "completion_tokens": completion_tokens,
+        # Eşzamanlılıkta istekler kuyrukta beklediği için bu bir alt sınırdır
+        "tokens_per_second": round(completion_tokens / llm_seconds, 2) if llm_seconds else None,
+        "paths": paths,
+        **accuracy([fields for _, _, fields in outcomes])
+    }
+
+def compare(current, baseline):
+    # Sadece regresyonları değil tüm farkları yazdırır
+    regressions = 0
+    for field, value in current["accuracy"].items():
+        before = baseline["accuracy"].get(field)
+        if before is None:
+            continue
+        flag = "REGRESSION" if value < before - ACCURACY_TOLERANCE else ""
+        regressions += bool(flag)
+        print(f"accuracy.{field}: {before} -> {value} {flag}".rstrip())
+    for stage, stats in current["stages"].items():
+        before = baseline["stages"].get(stage)
+        if before is None:
+            continue
+        for key in ("p50_ms", "p95_ms"):
+            flag = "REGRESSION" if stats[key] > before[key] * (1 + LATENCY_TOLERANCE) else ""
+            regressions += bool(flag)
+            print(f"{stage}.{key}: {before[key]} -> {stats[key]} {flag}".rstrip())
+    print(f"throughput_rps: {baseline['throughput_rps']} -> {current['throughput_rps']}")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay the synthetic receipts through the extraction pipeline")
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument("--model", action="store_true", help="Use the GGUF model at main.MODEL_PATH")
+    mode.add_argument("--stub", action="store_true", help="Use the deterministic local stub instead of a model")
+    parser.add_argument("--stub-ms-per-token", type=float, default=0.0, help="Simulated generation cost for --stub")
+    parser.add_argument("--path", choices=("llm", "pipeline"), default="llm",
+                        help="llm: always call process_with_llm; pipeline: extract_fields with the rule-based fast path")
+    parser.add_argument("--samples", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    parser.add_argument("--compare", help="Baseline JSON from an earlier run; exits 1 on regressions")
+    args = parser.parse_args()
+
+    main.extraction_log.enabled = False
+    if args.stub:
+        install_stub(args.stub_ms_per_token / 1000)
+    else:
+        require_model()
+
+    samples = load_samples(args.samples)
+    result = {
+        "run": {
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "git_revision": git_revision(),
+            "mode": "stub" if args.stub else "model",
+            "path": args.path,
+            "samples": len(samples),
+            "concurrency": args.concurrency,
+            "extraction_version": main.extraction_version,
+            "grammar": main.extraction_grammar is not None,
+            "ocr_compact": main.OCR_COMPACT,
+            "rule_threshold": main.RULE_EXTRACT_THRESHOLD
+        },
+        **run(samples, args.path, args.concurrency)
+    }
+    main.llm_scheduler.stop()
+
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    write_output(args.output, result)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare(result, baseline):
+            raise SystemExit(1)
@@ -0,0 +1,75 @@
+"""Prompt-lookup speculative decoding benchmark.
+
+Loads the model twice, once plain and once with the prompt-lookup draft model,
+and runs the extraction prompt for the OCR text of the synthetic receipts in
+data_gen/output/synthetic_receipts.jsonl. Decoding is greedy (temperature 0)
+so both modes must produce the same text; the report gives completion tokens
+per second, latency and the number of samples whose output differs. Needs the
+GGUF model at main.MODEL_PATH; set --gpu-layers 0 to force CPU.
+
+Usage (from the backend directory):
+    python bench_speculative.py --samples 30 --draft-tokens 2 4 10
+"""
+import argparse
+import json
+import statistics
+import time
+
+import main
+from bench_common import load_samples, percentile, write_output
+
+def run(prompts, draft_tokens, gpu_layers):
+    draft_model = None
+    if draft_tokens:
+        draft_model = main.LlamaPromptLookupDecoding(
+            max_ngram_size=main.LLM_PROMPT_LOOKUP_NGRAM,
+            num_pred_tokens=draft_tokens
+        )
+    llm = main.Llama(
+        model_path=main.MODEL_PATH,
+        n_gpu_layers=gpu_layers,
+        n_ctx=main.LLM_N_CTX,
+        draft_model=draft_model,
+        verbose=False
+    )
+    grammar = main.LlamaGrammar.from_string(main.EXTRACTION_GRAMMAR, verbose=False) if main.LLM_GRAMMAR else None
+    outputs = []
+    timings = []
+    tokens = 0
+    for prompt in prompts:
+        start = time.perf_counter()
+        output = llm(prompt, max_tokens=main.LLM_MAX_TOKENS, stop=["###"], echo=False, temperature=0.0, grammar=grammar)
+        timings.append(time.perf_counter() - start)
+        tokens += output["usage"]["completion_tokens"]
+        outputs.append(output["choices"][0]["text"])
+    return outputs, {
+        "draft_tokens": draft_tokens,
+        "samples": len(prompts),
+        "completion_tokens_per_second": round(tokens / sum(timings), 2),
+        "seconds_mean": round(statistics.mean(timings), 4),
+        "seconds_p95": round(percentile(timings, 0.95), 4)
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark prompt-lookup speculative decoding against plain decoding")
+    parser.add_argument("--samples", type=int, default=30)
+    parser.add_argument("--draft-tokens", type=int, nargs="+", default=[2, 4, 10])
+    parser.add_argument("--gpu-layers", type=int, default=0, help="0 = CPU only")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    if main.Llama is None or main.LlamaPromptLookupDecoding is None:
+        raise SystemExit("HATA: llama-cpp-python (prompt-lookup destekli) yüklü değil, benchmark çalıştırılamaz.")
+
+    prompts = [main.build_prompt(main.compact_ocr_text(sample["ocr_text"])) for sample in load_samples(args.samples)]
+    baseline_outputs, baseline = run(prompts, 0, args.gpu_layers)
+    results = [baseline]
+    for draft_tokens in args.draft_tokens:
+        outputs, result = run(prompts, draft_tokens, args.gpu_layers)
+        result["mismatched_outputs"] = sum(a != b for a, b in zip(outputs, baseline_outputs))
+        result["speedup"] = round(result["completion_tokens_per_second"] / baseline["completion_tokens_per_second"], 3)
+        results.append(result)
+
+    for result in results:
+        print(json.dumps(result))
+    write_output(args.output, results)
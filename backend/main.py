@@ -1,19 +1,39 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Form
+from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Request, Response, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
 import pytesseract
-from PIL import Image
+from PIL import Image, ImageChops, ImageFilter, ImageOps, UnidentifiedImageError
 import io
 import json
 import os
 import sqlite3
 import uuid
-import shutil
+import hashlib
+import base64
 from pathlib import Path
 from pydantic import BaseModel
-from typing import Optional
+from typing import Optional, List
 import sys
 import re
+import asyncio
+import threading
+import time
+import datetime
+import calendar
+from decimal import Decimal, ROUND_HALF_UP
+import queue
+import multiprocessing
+import bisect
+import cProfile
+import pstats
+import contextvars
+import random
+import logging
+import logging.handlers
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
 
 # Windows için Yaygın Tesseract Yolları
 possible_tesseract_paths = [
@@ -28,14 +48,79 @@ for path in possible_tesseract_paths:
         break
 
 
+# Tesserocr import (opsiyonel, kalıcı in-process Tesseract motoru için)
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
 # Llama-cpp-python import
 try:
-    from llama_cpp import Llama
+    import llama_cpp
+    from llama_cpp import Llama, LlamaGrammar
 except ImportError:
+    llama_cpp = None
     Llama = None
+    LlamaGrammar = None
+
+# Prompt-lookup taslak modeli (opsiyonel, eski sürümlerde yok)
+try:
+    from llama_cpp.llama_speculative import LlamaPromptLookupDecoding
+except ImportError:
+    LlamaPromptLookupDecoding = None
 
 app = FastAPI()
 
+# --- UPLOAD SIZE LIMIT ---
+class UploadSizeLimitMiddleware:
+    """Rejects oversized upload bodies before FastAPI buffers them.
+
+    `File(...)` parameters are parsed (and spooled) before the handler runs,
+    so the limit cannot be enforced there. A Content-Length above the limit
+    gets 413 without reading the body; a body without one (chunked) is cut
+    off with 413 as soon as it crosses the limit. `limits` maps a path to a
+    callable returning its byte limit.
+    """
+
+    def __init__(self, app, limits):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit_for = self.limits.get(scope["path"]) if scope["type"] == "http" else None
+        if limit_for is None:
+            await self.app(scope, receive, send)
+            return
+        limit = limit_for()
+        detail = f"Upload exceeds {limit} bytes"
+        content_length = dict(scope["headers"]).get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > limit:
+            await JSONResponse({"detail": detail}, status_code=413)(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # FastAPI gövde ayrıştırırken HTTPException'ı olduğu gibi geçirir
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+# CORS'tan önce eklenir: 413 yanıtları da CORS başlıklarını taşısın
+app.add_middleware(
+    UploadSizeLimitMiddleware,
+    limits={
+        "/upload": lambda: MAX_UPLOAD_BYTES,
+        "/upload/batch": lambda: MAX_UPLOAD_BYTES * MAX_BATCH_FILES
+    }
+)
+
 # CORS configuration
 origins = ["*"] # Geliştirme kolaylığı için *
 
@@ -45,6 +130,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 # --- CONFIGURATION ---
@@ -53,10 +139,520 @@ UPLOAD_DIR.mkdir(exist_ok=True)
 DB_PATH = "receipts.db"
 MODEL_PATH = "./models/Spendify/spendify_model_unsloth_q4_k_m.gguf"
 
+# Arka plan işleme (OCR + LLM) ayarları
+INGEST_WORKERS = int(os.getenv("SPENDIFY_INGEST_WORKERS", "2"))
+MAX_PENDING_JOBS = int(os.getenv("SPENDIFY_MAX_PENDING_JOBS", "100"))
+JOB_HISTORY_LIMIT = int(os.getenv("SPENDIFY_JOB_HISTORY_LIMIT", "500"))
+# Toplu yüklemede OCR süreç havuzu (varsayılan: çekirdek sayısı)
+OCR_PROCESSES = int(os.getenv("SPENDIFY_OCR_PROCESSES", str(os.cpu_count() or 1)))
+MAX_BATCH_FILES = int(os.getenv("SPENDIFY_MAX_BATCH_FILES", "50"))
+# Yükleme boyut sınırı (akış sırasında uygulanır) ve okuma parça boyutu
+MAX_UPLOAD_BYTES = int(os.getenv("SPENDIFY_MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = 256 * 1024
+UPLOAD_IO_WORKERS = int(os.getenv("SPENDIFY_UPLOAD_IO_WORKERS", "4"))
+# LLM zamanlayıcısı: ilk istek hemen başlar, kuyrukta hazır bekleyenler aynı partiye alınır.
+# Parti sırayla işlendiği için beklemek kazanç sağlamaz; varsayılan pencere 0
+LLM_MAX_BATCH_SIZE = int(os.getenv("SPENDIFY_LLM_MAX_BATCH_SIZE", "8"))
+LLM_MAX_WAIT_MS = float(os.getenv("SPENDIFY_LLM_MAX_WAIT_MS", "0"))
+# Çıktıyı altı alanlı JSON nesnesine kısıtlayan gramer (nesne kapanınca üretim durur)
+LLM_GRAMMAR = os.getenv("SPENDIFY_LLM_GRAMMAR", "1") == "1"
+LLM_N_CTX = int(os.getenv("SPENDIFY_LLM_N_CTX", "8192"))
+LLM_MAX_TOKENS = 256
+# CPU sunucularda birden fazla model örneği: her biri kendi thread dilimiyle çalışır,
+# GGUF ağırlıkları mmap ile paylaşılır (KV önbelleği örnek başınadır)
+LLM_INSTANCES = int(os.getenv("SPENDIFY_LLM_INSTANCES", "1"))
+LLM_THREADS_PER_INSTANCE = int(os.getenv("SPENDIFY_LLM_THREADS_PER_INSTANCE", "0"))
+LLM_PIN_CORES = os.getenv("SPENDIFY_LLM_PIN_CORES", "0") == "1"
+# Model yoksa MOCK MARKET cevabıyla çalış (sadece geliştirme için); aksi halde /upload 503 döner
+ALLOW_MOCK_LLM = os.getenv("SPENDIFY_ALLOW_MOCK_LLM", "0") == "1"
+MODEL_RETRY_AFTER_SECONDS = 5
+# Prompt-lookup spekülatif çözme: çıktı büyük ölçüde OCR metninden kopyalandığı için
+# taslak tokenler girişteki n-gramlardan önerilir (CPU'da 2-4, GPU'da ~10 önerilir)
+LLM_PROMPT_LOOKUP = os.getenv("SPENDIFY_LLM_PROMPT_LOOKUP", "0") == "1"
+LLM_PROMPT_LOOKUP_TOKENS = int(os.getenv("SPENDIFY_LLM_PROMPT_LOOKUP_TOKENS", "4"))
+LLM_PROMPT_LOOKUP_NGRAM = int(os.getenv("SPENDIFY_LLM_PROMPT_LOOKUP_NGRAM", "2"))
+# OCR metnini prompta koymadan önce sıkıştır (gürültü satırları, uzun kalem listeleri)
+OCR_COMPACT = os.getenv("SPENDIFY_OCR_COMPACT", "1") == "1"
+OCR_COMPACT_MAX_LINES = int(os.getenv("SPENDIFY_OCR_COMPACT_MAX_LINES", "40"))
+OCR_COMPACT_HEAD_LINES = int(os.getenv("SPENDIFY_OCR_COMPACT_HEAD_LINES", "8"))
+# Toplam anahtar kelimesi OCR'da bozulursa toplam satırı ilk KDV satırından hemen önce kalır
+OCR_COMPACT_TAIL_CONTEXT = int(os.getenv("SPENDIFY_OCR_COMPACT_TAIL_CONTEXT", "2"))
+# Kural tabanlı hızlı yol: tüm alanlar eşiği geçerse LLM çağrılmaz
+RULE_EXTRACT_ENABLED = os.getenv("SPENDIFY_RULE_EXTRACT", "1") == "1"
+RULE_EXTRACT_THRESHOLD = float(os.getenv("SPENDIFY_RULE_EXTRACT_THRESHOLD", "0.8"))
+# Aynı görüntü tekrar yüklendiğinde sonucu önbellekten dön (bellek LRU + SQLite)
+RESULT_CACHE_MAX_ITEMS = int(os.getenv("SPENDIFY_RESULT_CACHE_MAX_ITEMS", "1024"))
+RESULT_CACHE_MAX_ROWS = int(os.getenv("SPENDIFY_RESULT_CACHE_MAX_ROWS", "50000"))
+# Normalize edilmiş OCR metni -> LLM sonucu önbelleği
+TEXT_CACHE_MAX_ITEMS = int(os.getenv("SPENDIFY_TEXT_CACHE_MAX_ITEMS", "4096"))
+# OCR motoru: "pytesseract" (her çağrıda yeni süreç) veya "tesserocr" (kalıcı API)
+OCR_BACKEND = os.getenv("SPENDIFY_OCR_BACKEND", "pytesseract")
+OCR_LANG = os.getenv("SPENDIFY_OCR_LANG", "eng")
+TESSDATA_PATH = os.getenv("SPENDIFY_TESSDATA_PATH")
+# OCR öncesi görüntü ön işleme (EXIF yönü, küçültme, gri ton, adaptif eşikleme)
+OCR_PREPROCESS = os.getenv("SPENDIFY_OCR_PREPROCESS", "1") == "1"
+OCR_TARGET_WIDTH = int(os.getenv("SPENDIFY_OCR_TARGET_WIDTH", "1200"))
+OCR_BINARIZE = os.getenv("SPENDIFY_OCR_BINARIZE", "1") == "1"
+OCR_BINARIZE_RADIUS = int(os.getenv("SPENDIFY_OCR_BINARIZE_RADIUS", "15"))
+OCR_BINARIZE_OFFSET = int(os.getenv("SPENDIFY_OCR_BINARIZE_OFFSET", "10"))
+# LLM çıkarım kaydı (JSON satırları, arka planda yazılır, boyuta göre döndürülür)
+EXTRACTION_LOG_ENABLED = os.getenv("SPENDIFY_EXTRACTION_LOG", "1") == "1"
+EXTRACTION_LOG_PATH = os.getenv("SPENDIFY_EXTRACTION_LOG_PATH", "extraction_log.jsonl")
+EXTRACTION_LOG_MAX_BYTES = int(os.getenv("SPENDIFY_EXTRACTION_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+EXTRACTION_LOG_BACKUPS = int(os.getenv("SPENDIFY_EXTRACTION_LOG_BACKUPS", "5"))
+EXTRACTION_LOG_SAMPLE_RATE = float(os.getenv("SPENDIFY_EXTRACTION_LOG_SAMPLE_RATE", "1.0"))
+EXTRACTION_LOG_INCLUDE_TEXT = os.getenv("SPENDIFY_EXTRACTION_LOG_INCLUDE_TEXT", "1") == "1"
+EXTRACTION_LOG_QUEUE_SIZE = 10000
+# İstek profilleme: başlık/sorgu ile tetikleme sadece açıkça izin verilirse; örnekleme oranı ayrı
+PROFILING_ENABLED = os.getenv("SPENDIFY_PROFILING", "0") == "1"
+PROFILING_TOKEN = os.getenv("SPENDIFY_PROFILING_TOKEN")
+PROFILE_SAMPLE_RATE = float(os.getenv("SPENDIFY_PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("SPENDIFY_PROFILE_DIR", "./profiles")
+PROFILE_MAX_FILES = int(os.getenv("SPENDIFY_PROFILE_MAX_FILES", "50"))
+
 # Static Files (Resimleri sunmak için)
 app.mount("/static", StaticFiles(directory="uploads"), name="static")
 
+# --- METRICS ---
+# Prometheus metin formatında basit sayaç/histogram kaydı (harici bağımlılık yok).
+# Gözlem başına bir kilit + bisect; istek yolunda maliyet mikro saniye düzeyinde.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape_label(value)}"' for key, value in labels) + "}"
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # Etiketsiz sayaç hiç artmasa da 0 olarak görünsün
+        self._values = {} if self.labelnames else {(): 0}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            lines.append(f"{self.name}{_format_labels(zip(self.labelnames, key))} {_format_value(value)}")
+        return lines
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # etiket -> [kova sayıları (kümülatif değil) + [+Inf], toplam, adet]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = [(key, list(counts), total, count) for key, (counts, total, count) in self._series.items()]
+        for key, counts, total, count in series:
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else _format_value(float(bound))
+                lines.append(f"{self.name}_bucket{_format_labels(labels + [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+class MetricsRegistry:
+    """Holds counters/histograms plus collectors that read existing stats at scrape time.
+
+    A collector returns (name, type, help, [(labels_dict, value), ...]) tuples,
+    which lets the scheduler, cache and job counters that already exist be
+    exported without double bookkeeping on the hot path.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, func):
+        self._collectors.append(func)
+        return func
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collect in self._collectors:
+            try:
+                families = collect()
+            except Exception as e:
+                print(f"UYARI: Metrik toplayıcı {collect.__name__} başarısız: {e}")
+                continue
+            for name, kind, documentation, samples in families:
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(sorted(labels.items()))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+stage_seconds = metrics.histogram(
+    "spendify_stage_seconds", "Time spent in each ingestion/extraction stage.", ["stage"]
+)
+http_request_seconds = metrics.histogram(
+    "spendify_http_request_seconds", "HTTP request latency by route.", ["method", "route", "status"]
+)
+db_seconds = metrics.histogram(
+    "spendify_db_seconds", "Time per pooled SQLite connection use (acquire, queries, commit) by endpoint.", ["endpoint"]
+)
+fallback_results = metrics.counter(
+    "spendify_llm_fallbacks_total", "LLM outputs that could not be parsed and fell back to defaults."
+)
+mock_responses = metrics.counter(
+    "spendify_mock_responses_total", "Responses served from mock OCR text or mock LLM output.", ["kind"]
+)
+# İstek bağlamı: veritabanı sürelerini hangi uç noktanın ürettiğini bilmek için
+current_request_scope = contextvars.ContextVar("current_request_scope", default=None)
+
+def current_endpoint():
+    scope = current_request_scope.get()
+    if scope is None:
+        return "background"
+    route = scope.get("route")
+    return getattr(route, "path", "unmatched")
+
 # --- DATABASE SETUP ---
+MIGRATION_BATCH_SIZE = 500
+DB_POOL_SIZE = int(os.getenv("SPENDIFY_DB_POOL_SIZE", "8"))
+DB_BUSY_TIMEOUT_MS = int(os.getenv("SPENDIFY_DB_BUSY_TIMEOUT_MS", "5000"))
+DB_CACHE_SIZE_KB = int(os.getenv("SPENDIFY_DB_CACHE_SIZE_KB", "20000"))
+DB_MMAP_SIZE = int(os.getenv("SPENDIFY_DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+DB_STATEMENT_CACHE = 256
+
+class ConnectionPool:
+    """Fixed-size pool of long-lived SQLite connections in WAL mode.
+
+    WAL lets readers run while a writer commits, and keeping connections open
+    means sqlite3's per-connection statement cache actually gets reused across
+    requests. `connection()` commits on success and rolls back on error.
+    """
+
+    def __init__(self, path, size=DB_POOL_SIZE):
+        self.path = path
+        self.size = max(1, size)
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=DB_BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,
+            cached_statements=DB_STATEMENT_CACHE
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        # WAL ile NORMAL güvenli: sadece güç kesintisinde son commit kaybolabilir
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB}")
+        conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        return self._idle.get(timeout=DB_BUSY_TIMEOUT_MS / 1000)
+
+    @contextmanager
+    def connection(self):
+        start = time.perf_counter()
+        conn = self._acquire()
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            self._idle.put(conn)
+            db_seconds.observe(time.perf_counter() - start, endpoint=current_endpoint())
+
+    def close(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+db_pool = ConnectionPool(DB_PATH)
+
+def to_minor_units(text):
+    # "1.234,50 TL" -> 123450 (kuruş/cent); clean_amount ile aynı ayrıştırma
+    return int((Decimal(clean_amount(text)) * 100).to_integral_value(ROUND_HALF_UP))
+
+def to_iso_date(text):
+    # dd.mm.yyyy, dd/mm/yyyy, dd-mm-yyyy, dd.mm.yy ve yyyy-mm-dd desteklenir
+    if not text:
+        return None
+    text = text.strip()
+    match = re.match(r'^(\d{4})-(\d{1,2})-(\d{1,2})', text)
+    if match:
+        year, month, day = (int(g) for g in match.groups())
+    else:
+        match = re.match(r'^(\d{1,2})[./-](\d{1,2})[./-](\d{2,4})', text)
+        if not match:
+            return None
+        day, month, year = (int(g) for g in match.groups())
+        if year < 100:
+            year += 2000
+    try:
+        return datetime.date(year, month, day).isoformat()
+    except ValueError:
+        return None
+
+def _column_names(c, table):
+    return {row[1] for row in c.execute(f"PRAGMA table_info({table})")}
+
+def _migration_001_currency(conn):
+    """currency column for databases created before it existed."""
+    c = conn.cursor()
+    if "currency" not in _column_names(c, "receipts"):
+        c.execute("ALTER TABLE receipts ADD COLUMN currency TEXT")
+    conn.commit()
+
+def _migration_002_result_cache(conn):
+    """Persistent upload result cache keyed by image hash and extraction version."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS result_cache (
+            key TEXT PRIMARY KEY,
+            structured_data TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_hit_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.commit()
+
+def _migration_003_typed_columns(conn):
+    """Integer minor-unit amounts, ISO receipt date and query indexes."""
+    c = conn.cursor()
+    columns = _column_names(c, "receipts")
+    for name, ddl in (("total_minor", "INTEGER"), ("tax_minor", "INTEGER"), ("date_iso", "TEXT")):
+        if name not in columns:
+            c.execute(f"ALTER TABLE receipts ADD COLUMN {name} {ddl}")
+    conn.commit()
+
+    # Backfill: her parti ayrı commit edilir, büyük tablolarda kilit kısa kalır
+    last_rowid = 0
+    while True:
+        c.execute(
+            "SELECT rowid, date, total, tax FROM receipts WHERE rowid > ? ORDER BY rowid LIMIT ?",
+            (last_rowid, MIGRATION_BATCH_SIZE)
+        )
+        rows = c.fetchall()
+        if not rows:
+            break
+        c.executemany(
+            "UPDATE receipts SET total_minor=?, tax_minor=?, date_iso=? WHERE rowid=?",
+            [(to_minor_units(total), to_minor_units(tax), to_iso_date(date), rowid) for rowid, date, total, tax in rows]
+        )
+        conn.commit()
+        last_rowid = rows[-1][0]
+
+    c.execute("CREATE INDEX IF NOT EXISTS idx_receipts_created ON receipts (created_at DESC, id DESC)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_receipts_category_created ON receipts (category, created_at DESC, id DESC)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_receipts_merchant_created ON receipts (merchant, created_at DESC, id DESC)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_receipts_date_iso ON receipts (date_iso)")
+    conn.commit()
+
+# --- ROLLUPS ---
+# (currency, category, gün/ay) bazında önceden toplanmış harcama tabloları.
+# create/update/delete aynı işlem içinde artımlı olarak günceller.
+ROLLUP_CURRENCY_SQL = "COALESCE(NULLIF(currency, ''), '₺')"
+ROLLUP_CATEGORY_SQL = "COALESCE(NULLIF(category, ''), 'Other')"
+
+def _rollup_dimensions(currency, category):
+    return currency or "₺", category or "Other"
+
+def apply_rollup_delta(conn, currency, category, date_iso, amount_minor, count):
+    if not date_iso:
+        return
+    currency, category = _rollup_dimensions(currency, category)
+    for table, column, key in (("spend_daily", "day", date_iso), ("spend_monthly", "month", date_iso[:7])):
+        conn.execute(f"""
+            INSERT INTO {table} (currency, category, {column}, total_minor, receipt_count)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (currency, {column}, category) DO UPDATE SET
+                total_minor = total_minor + excluded.total_minor,
+                receipt_count = receipt_count + excluded.receipt_count
+        """, (currency, category, key, amount_minor or 0, count))
+        conn.execute(
+            f"DELETE FROM {table} WHERE currency=? AND {column}=? AND category=? AND receipt_count <= 0",
+            (currency, key, category)
+        )
+
+def rebuild_rollups(conn):
+    conn.execute("DELETE FROM spend_daily")
+    conn.execute("DELETE FROM spend_monthly")
+    conn.execute(f"""
+        INSERT INTO spend_daily (currency, category, day, total_minor, receipt_count)
+        SELECT {ROLLUP_CURRENCY_SQL}, {ROLLUP_CATEGORY_SQL}, date_iso, COALESCE(SUM(total_minor), 0), COUNT(*)
+        FROM receipts
+        WHERE date_iso IS NOT NULL
+        GROUP BY 1, 2, 3
+    """)
+    conn.execute("""
+        INSERT INTO spend_monthly (currency, category, month, total_minor, receipt_count)
+        SELECT currency, category, substr(day, 1, 7), SUM(total_minor), SUM(receipt_count)
+        FROM spend_daily
+        GROUP BY 1, 2, 3
+    """)
+
+def _migration_004_rollups(conn):
+    """Daily and monthly spend rollups per currency and category."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS spend_daily (
+            currency TEXT NOT NULL,
+            category TEXT NOT NULL,
+            day TEXT NOT NULL,
+            total_minor INTEGER NOT NULL DEFAULT 0,
+            receipt_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (currency, day, category)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS spend_monthly (
+            currency TEXT NOT NULL,
+            category TEXT NOT NULL,
+            month TEXT NOT NULL,
+            total_minor INTEGER NOT NULL DEFAULT 0,
+            receipt_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (currency, month, category)
+        ) WITHOUT ROWID
+    """)
+    rebuild_rollups(conn)
+    conn.commit()
+
+def _migration_005_fts(conn):
+    """Stored OCR text and an FTS5 index over merchant, category and OCR text."""
+    if "ocr_text" not in _column_names(conn.cursor(), "receipts"):
+        conn.execute("ALTER TABLE receipts ADD COLUMN ocr_text TEXT")
+    # Harici içerikli tablo: metin receipts'te tutulur, indeks tetikleyicilerle güncellenir.
+    # remove_diacritics sayesinde "süt" araması "SUT" ile de eşleşir.
+    conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS receipts_fts USING fts5(
+            merchant, category, ocr_text,
+            content='receipts', content_rowid='rowid',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3'
+        )
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS receipts_fts_ai AFTER INSERT ON receipts BEGIN
+            INSERT INTO receipts_fts (rowid, merchant, category, ocr_text)
+            VALUES (new.rowid, new.merchant, new.category, new.ocr_text);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS receipts_fts_ad AFTER DELETE ON receipts BEGIN
+            INSERT INTO receipts_fts (receipts_fts, rowid, merchant, category, ocr_text)
+            VALUES ('delete', old.rowid, old.merchant, old.category, old.ocr_text);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS receipts_fts_au AFTER UPDATE OF merchant, category, ocr_text ON receipts BEGIN
+            INSERT INTO receipts_fts (receipts_fts, rowid, merchant, category, ocr_text)
+            VALUES ('delete', old.rowid, old.merchant, old.category, old.ocr_text);
+            INSERT INTO receipts_fts (rowid, merchant, category, ocr_text)
+            VALUES (new.rowid, new.merchant, new.category, new.ocr_text);
+        END
+    """)
+    conn.execute("INSERT INTO receipts_fts (receipts_fts) VALUES ('rebuild')")
+    conn.commit()
+
+# Sıralı şema göçleri; sürüm PRAGMA user_version içinde tutulur.
+# Her göç yarıda kesilirse tekrar çalıştırılabilir (idempotent) olmalıdır.
+MIGRATIONS = [
+    _migration_001_currency,
+    _migration_002_result_cache,
+    _migration_003_typed_columns,
+    _migration_004_rollups,
+    _migration_005_fts,
+]
+
+def run_migrations(conn):
+    current = conn.execute("PRAGMA user_version").fetchone()[0]
+    for version, migration in enumerate(MIGRATIONS, start=1):
+        if version <= current:
+            continue
+        start = time.perf_counter()
+        migration(conn)
+        conn.execute(f"PRAGMA user_version = {version}")
+        conn.commit()
+        print(f"INFO: Migration {version} ({migration.__name__}) applied in {time.perf_counter() - start:.2f}s.")
+
 def init_db():
     conn = sqlite3.connect(DB_PATH)
     c = conn.cursor()
@@ -76,47 +672,489 @@ def init_db():
         )
     ''')
     conn.commit()
-    
-    # Add currency column if it doesn't exist (Migration)
-    try:
-        c.execute("ALTER TABLE receipts ADD COLUMN currency TEXT")
-        print("INFO: Added 'currency' column to receipts table.")
-        conn.commit()
-    except sqlite3.OperationalError:
-        # Column likely already exists
-        pass
-        
+
+    run_migrations(conn)
     conn.close()
 
-init_db()
+
+# --- PROMPT ---
+# Sabit talimat + few-shot örnekleri. Bu önek her istekte aynıdır; KV önbelleği
+# model yüklenirken bir kez hesaplanır; KV önbelleğinden düşerse geri yüklenir.
+PROMPT_PREFIX = """Below is an instruction that describes a task, paired with an input that provides further context. Write a response that appropriately completes the request.
+
+### Instruction:
+You are an advanced receipt understanding AI. Analyze the input OCR text and extract the following JSON fields.
+
+Rules:
+1. **merchant**: The name of the shop. **ALWAYS** return the very first meaningful line of text as the merchant if no known brand is found.
+2. **date**: The date of the transaction as found on the receipt.
+3. **total_amount**: The final grand total amount.
+4. **tax**: The tax amount (VAT, TAX) if available.
+5. **tax_rate**: The tax rate percentage if available.
+6. **currency**: The currency symbol found on the receipt.
+
+### Reference Examples (Do NOT copy these values):
+Input:
+TARGET STORE
+12.04.2023
+TOTAL 7.50
+
+Response:
+{
+  "merchant": "TARGET STORE",
+  "date": "12.04.2023",
+  "total_amount": "7.50",
+  "tax": "0.00",
+  "tax_rate": "0",
+  "currency": "$"
+}
+
+Input:
+Uber Eats
+Date: Nov 10, 2024
+Total: 25.50
+
+Response:
+{
+  "merchant": "Uber Eats",
+  "date": "10.11.2024",
+  "total_amount": "25.50",
+  "tax": "1.50",
+  "tax_rate": "0",
+  "currency": "$"
+}
+
+### REAL TASK (Analyze the below text):
+Input:
+"""
+PROMPT_SUFFIX = """
+
+### Response:
+"""
+
+EXTRACTION_FIELDS = ("merchant", "date", "total_amount", "tax", "tax_rate", "currency")
+
+def build_extraction_grammar(fields=EXTRACTION_FIELDS):
+    # GBNF: alanlar few-shot örnekleriyle aynı sırada, değerlerin hepsi string
+    members = ' "," ws '.join(f'"\\"{name}\\":" ws string' for name in fields)
+    return "\n".join([
+        f'root ::= "{{" ws {members} ws "}}"',
+        r'string ::= "\"" char* "\""',
+        r'char ::= [^"\\\x00-\x1F] | "\\" (["\\/bfnrt] | "u" [0-9a-fA-F] [0-9a-fA-F] [0-9a-fA-F] [0-9a-fA-F])',
+        r'ws ::= | " " | "\n" | "\n  "'
+    ])
+
+EXTRACTION_GRAMMAR = build_extraction_grammar()
+
+def build_prompt(ocr_text):
+    return PROMPT_PREFIX + ocr_text + PROMPT_SUFFIX
+
+def compute_extraction_version():
+    # Model dosyası veya prompt değişince önbellek anahtarları da değişir
+    h = hashlib.sha256()
+    h.update(MODEL_PATH.encode("utf-8"))
+    if os.path.exists(MODEL_PATH):
+        st = os.stat(MODEL_PATH)
+        h.update(f"{st.st_size}:{st.st_mtime_ns}".encode("utf-8"))
+    h.update(PROMPT_PREFIX.encode("utf-8"))
+    h.update(PROMPT_SUFFIX.encode("utf-8"))
+    h.update(f"rules:{RULE_EXTRACT_ENABLED}:{RULE_EXTRACT_THRESHOLD}".encode("utf-8"))
+    # Görüntü önbelleği anahtarı OCR hattını da kapsar: ön işleme veya motor değişince eski OCR metni dönmesin
+    ocr_engine = "tesserocr" if OCR_BACKEND == "tesserocr" and tesserocr is not None else "pytesseract"
+    h.update(f"ocr:{ocr_engine}:{OCR_LANG}:{OCR_PREPROCESS}:{OCR_TARGET_WIDTH}:{OCR_BINARIZE}:{OCR_BINARIZE_RADIUS}:{OCR_BINARIZE_OFFSET}".encode("utf-8"))
+    h.update(f"compact:{OCR_COMPACT}:{OCR_COMPACT_MAX_LINES}:{OCR_COMPACT_HEAD_LINES}:{OCR_COMPACT_TAIL_CONTEXT}".encode("utf-8"))
+    if LLM_GRAMMAR:
+        h.update(EXTRACTION_GRAMMAR.encode("utf-8"))
+    return h.hexdigest()[:16]
+
+extraction_version = compute_extraction_version()
 
 # --- MODEL SETUP ---
 llm = None
+llm_scheduler = None
+extraction_grammar = None
+# loading -> ready | mock | failed; /health/ready ve /upload buna bakar
+model_state = {
+    "status": "loading",
+    "error": None,
+    "load_seconds": None,
+    "warmup_seconds": None,
+    "instances": 0
+}
+# n_ctx - üretim payı - prompt şablonu; OCR metni bu kadar tokene sığmalı
+ocr_token_budget = None
+
+def count_llm_tokens(text):
+    # Sadece sözlük okunur, zamanlayıcı thread'i dışında da güvenli
+    return len(llm.tokenize(text.encode("utf-8"), add_bos=False, special=False))
+
+def read_llama_timings(model):
+    # (prompt değerlendirme, üretim) saniyeleri llama.cpp perf sayaçlarından; sayaçlar sıfırlanır.
+    # Sürüm bu API'leri sunmuyorsa None (sadece toplam süre ölçülür).
+    ctx = getattr(model, "ctx", None)
+    if llama_cpp is None or ctx is None:
+        return None
+    try:
+        if hasattr(llama_cpp, "llama_perf_context"):
+            data = llama_cpp.llama_perf_context(ctx)
+            llama_cpp.llama_perf_context_reset(ctx)
+        else:
+            data = llama_cpp.llama_get_timings(ctx)
+            llama_cpp.llama_reset_timings(ctx)
+        return data.t_p_eval_ms / 1000, data.t_eval_ms / 1000
+    except Exception:
+        return None
+
+class LLMScheduler:
+    """Owns a single Llama instance and serializes all access to it.
+
+    llama.cpp contexts are not thread-safe, so every generation goes through one
+    worker thread. Requests arriving within `max_wait_ms` of each other are
+    collected into a micro-batch (up to `max_batch_size`) and run back to back,
+    which keeps the model hot and avoids lock hand-offs between uploads.
+
+    If `prime_prefix` was called, the saved KV state of the static prompt prefix
+    is restored before each matching prompt so llama.cpp only evaluates the
+    receipt-specific suffix.
+    """
+
+    def __init__(self, model, max_batch_size=LLM_MAX_BATCH_SIZE, max_wait_ms=LLM_MAX_WAIT_MS,
+                 cpu_affinity=None, name="llm-scheduler"):
+        self.model = model
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.cpu_affinity = cpu_affinity
+        self._queue = queue.Queue()
+        self._stopped = threading.Event()
+        self._outstanding = 0
+        self._outstanding_lock = threading.Lock()
+        self.stats = {
+            "requests": 0,
+            "batches": 0,
+            "max_batch_seen": 0,
+            "prefix_hits": 0,
+            "prefix_misses": 0,
+            "prefix_restores": 0,
+            "prefix_tokens_reused": 0,
+            "prefix_seconds_saved": 0.0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0
+        }
+        self.prefix = None
+        self.prefix_state = None
+        self.prefix_tokens = 0
+        self.prefix_token_ids = []
+        self.prefix_seconds_per_token = 0.0
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, prompt, **kwargs):
+        if self._stopped.is_set():
+            raise RuntimeError("LLM scheduler is stopped")
+        future = Future()
+        with self._outstanding_lock:
+            self._outstanding += 1
+        future.add_done_callback(self._release)
+        self._queue.put((prompt, kwargs, future, time.perf_counter()))
+        return future
+
+    def _release(self, future):
+        with self._outstanding_lock:
+            self._outstanding -= 1
+
+    def load(self):
+        # Kuyrukta bekleyen + şu an üretilen istekler
+        return self._outstanding
+
+    def generate(self, prompt, **kwargs):
+        return self.submit(prompt, **kwargs).result()
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def prime_prefix(self, prefix):
+        # Worker thread henüz modele dokunmadan (yükleme sırasında) çağrılmalı
+        tokens = self.model.tokenize(prefix.encode("utf-8"), add_bos=True, special=True)
+        start = time.perf_counter()
+        self.model.reset()
+        self.model.eval(tokens)
+        elapsed = time.perf_counter() - start
+        self.prefix_state = self.model.save_state()
+        self.prefix = prefix
+        self.prefix_tokens = len(tokens)
+        self.prefix_token_ids = list(tokens)
+        self.prefix_seconds_per_token = elapsed / max(1, len(tokens))
+        print(f"BİLGİ: Prompt öneki önbelleğe alındı ({len(tokens)} token, {elapsed:.2f}s).")
+
+    def _restore_prefix(self, prompt):
+        if self.prefix_state is None:
+            return
+        if not prompt.startswith(self.prefix):
+            self.stats["prefix_misses"] += 1
+            return
+        # generate() mevcut KV ile en uzun ortak öneki zaten yeniden kullanır;
+        # durum yalnızca önek KV'den silindiyse (ör. önek dışı bir prompt) geri yüklenir
+        if (self.model.n_tokens < self.prefix_tokens
+                or list(self.model.input_ids[:self.prefix_tokens]) != self.prefix_token_ids):
+            self.model.load_state(self.prefix_state)
+            self.stats["prefix_restores"] += 1
+        # Önek KV'de hazır (yerinde veya geri yüklenmiş): değerlendirmesi atlanır
+        self.stats["prefix_hits"] += 1
+        self.stats["prefix_tokens_reused"] += self.prefix_tokens
+        self.stats["prefix_seconds_saved"] += self.prefix_tokens * self.prefix_seconds_per_token
+
+    def stop(self):
+        self._stopped.set()
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+    def _collect_batch(self):
+        first = self._queue.get()
+        if first is None:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._stopped.set()
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        if self.cpu_affinity and hasattr(os, "sched_setaffinity"):
+            # llama.cpp'nin bu thread'den açtığı işçi thread'ler de aynı çekirdeklerde kalır
+            os.sched_setaffinity(0, self.cpu_affinity)
+        while not self._stopped.is_set():
+            batch = self._collect_batch()
+            if not batch:
+                break
+            self.stats["batches"] += 1
+            self.stats["requests"] += len(batch)
+            self.stats["max_batch_seen"] = max(self.stats["max_batch_seen"], len(batch))
+            for prompt, kwargs, future, enqueued_at in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                stage_seconds.observe(time.perf_counter() - enqueued_at, stage="llm_queue_wait")
+                try:
+                    self._restore_prefix(prompt)
+                    output = self.model(prompt, **kwargs)
+                    timings = read_llama_timings(self.model)
+                    if timings is not None:
+                        stage_seconds.observe(timings[0], stage="llm_prompt_eval")
+                        stage_seconds.observe(timings[1], stage="llm_generation")
+                    usage = output.get("usage") or {}
+                    self.stats["prompt_tokens"] += usage.get("prompt_tokens", 0)
+                    self.stats["completion_tokens"] += usage.get("completion_tokens", 0)
+                    future.set_result(output)
+                except Exception as e:
+                    future.set_exception(e)
+        # Kapanışta bekleyen istekleri boşta bırakma
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                item[2].set_exception(RuntimeError("LLM scheduler is stopped"))
+
+class LLMPool:
+    """Least-loaded dispatcher over several LLMScheduler instances.
+
+    Exposes the same submit/generate/pending/stats surface as a single
+    scheduler, so callers do not care how many model instances are loaded.
+    """
+
+    SUMMED_STATS = ("requests", "batches", "prefix_hits", "prefix_misses", "prefix_restores", "prefix_tokens_reused",
+                    "prefix_seconds_saved", "prompt_tokens", "completion_tokens")
+
+    def __init__(self, schedulers):
+        self.schedulers = list(schedulers)
+        self._lock = threading.Lock()
+
+    def submit(self, prompt, **kwargs):
+        with self._lock:
+            scheduler = min(self.schedulers, key=lambda s: s.load())
+            return scheduler.submit(prompt, **kwargs)
+
+    def generate(self, prompt, **kwargs):
+        return self.submit(prompt, **kwargs).result()
+
+    def pending(self):
+        return sum(s.pending() for s in self.schedulers)
+
+    def prime_prefix(self, prefix):
+        for scheduler in self.schedulers:
+            scheduler.prime_prefix(prefix)
+
+    @property
+    def prefix_tokens(self):
+        return self.schedulers[0].prefix_tokens
+
+    @property
+    def stats(self):
+        merged = {key: sum(s.stats[key] for s in self.schedulers) for key in self.SUMMED_STATS}
+        merged["max_batch_seen"] = max(s.stats["max_batch_seen"] for s in self.schedulers)
+        return merged
+
+    def instance_stats(self):
+        return [
+            {
+                "load": s.load(),
+                "requests": s.stats["requests"],
+                "n_threads": getattr(s.model, "n_threads", None),
+                "cpu_affinity": sorted(s.cpu_affinity) if s.cpu_affinity else None
+            }
+            for s in self.schedulers
+        ]
+
+    def stop(self):
+        for scheduler in self.schedulers:
+            scheduler.stop()
+
+def instance_layout(instances, threads_per_instance, cpu_count):
+    # [(n_threads veya None, çekirdek kümesi veya None)], örnek başına bir tane
+    if threads_per_instance <= 0:
+        # Tek örnekte llama.cpp varsayılanı korunur
+        threads_per_instance = max(1, cpu_count // instances) if instances > 1 else None
+    layout = []
+    for i in range(instances):
+        cores = None
+        if LLM_PIN_CORES and threads_per_instance:
+            start = (i * threads_per_instance) % cpu_count
+            cores = {(start + j) % cpu_count for j in range(threads_per_instance)}
+        layout.append((threads_per_instance, cores))
+    return layout
+
+def _model_unavailable(message):
+    print(f"UYARI: {message}")
+    if ALLOW_MOCK_LLM:
+        print("UYARI: Mock modunda çalışacak.")
+        model_state.update(status="mock", error=message)
+    else:
+        model_state.update(status="failed", error=message)
+
+def warmup_model():
+    # Kısa bir üretim: ilk isteğin ödeyeceği tembel ayırmaları/ısınmayı öne çeker
+    start = time.perf_counter()
+    llm_scheduler.generate(build_prompt("WARMUP"), max_tokens=4, temperature=0.0)
+    return time.perf_counter() - start
 
 def load_model():
-    global llm
+    global llm, llm_scheduler, extraction_version, extraction_grammar, ocr_token_budget
+    extraction_version = compute_extraction_version()
+    model_state.update(status="loading", error=None, load_seconds=None, warmup_seconds=None, instances=0)
+    # Yeniden yüklemede eski örneklerin thread'leri ve model belleği bırakılır
+    if llm_scheduler is not None:
+        llm = None
+        llm_scheduler.stop()
+        llm_scheduler = None
     if Llama is None:
-        print("UYARI: llama-cpp-python yüklü değil. Mock modunda çalışacak.")
+        _model_unavailable("llama-cpp-python yüklü değil.")
         return
 
     if not os.path.exists(MODEL_PATH):
-        print(f"UYARI: Model dosyası bulunamadı: {MODEL_PATH}. Lütfen modeli bu dizine koyun.")
+        _model_unavailable(f"Model dosyası bulunamadı: {MODEL_PATH}. Lütfen modeli bu dizine koyun.")
         return
 
+    draft_model = None
+    if LLM_PROMPT_LOOKUP:
+        if LlamaPromptLookupDecoding is None:
+            print("UYARI: Bu llama-cpp-python sürümünde prompt-lookup desteği yok, normal çözme kullanılacak.")
+        else:
+            draft_model = LlamaPromptLookupDecoding(
+                max_ngram_size=LLM_PROMPT_LOOKUP_NGRAM,
+                num_pred_tokens=LLM_PROMPT_LOOKUP_TOKENS
+            )
+
+    start = time.perf_counter()
+    schedulers = []
     try:
-        llm = Llama(
-            model_path=MODEL_PATH,
-            n_gpu_layers=-1, 
-            n_ctx=8192,
-            verbose=False
+        for i, (n_threads, cores) in enumerate(instance_layout(max(1, LLM_INSTANCES), LLM_THREADS_PER_INSTANCE, os.cpu_count() or 1)):
+            thread_kwargs = {"n_threads": n_threads, "n_threads_batch": n_threads} if n_threads else {}
+            model = Llama(
+                model_path=MODEL_PATH,
+                n_gpu_layers=-1, 
+                n_ctx=LLM_N_CTX,
+                draft_model=draft_model,
+                use_mmap=True,
+                verbose=False,
+                **thread_kwargs
+            )
+            schedulers.append(LLMScheduler(model, cpu_affinity=cores, name=f"llm-scheduler-{i}"))
+        model = schedulers[0].model
+        template_tokens = len(model.tokenize((PROMPT_PREFIX + PROMPT_SUFFIX).encode("utf-8"), add_bos=True, special=True))
+        ocr_token_budget = max(0, LLM_N_CTX - LLM_MAX_TOKENS - template_tokens)
+        llm_scheduler = LLMPool(schedulers)
+        if LLM_GRAMMAR:
+            try:
+                extraction_grammar = LlamaGrammar.from_string(EXTRACTION_GRAMMAR, verbose=False)
+            except Exception as e:
+                # Gramer olmadan serbest üretim + clean_json_output ile devam
+                print(f"UYARI: JSON grameri derlenemedi: {e}")
+        try:
+            llm_scheduler.prime_prefix(PROMPT_PREFIX)
+        except Exception as e:
+            # Önek önbelleği olmadan da çalışır, sadece daha yavaş
+            print(f"UYARI: Prompt öneki önbelleğe alınamadı: {e}")
+        load_seconds = time.perf_counter() - start
+        warmup_seconds = warmup_model()
+        # llm en son atanır: process_with_llm yarım yüklenmiş modeli görmesin
+        llm = model
+        model_state.update(
+            status="ready",
+            load_seconds=round(load_seconds, 3),
+            warmup_seconds=round(warmup_seconds, 3),
+            instances=len(schedulers)
         )
-        print("BAŞARILI: Llama modeli yüklendi.")
+        print(f"BAŞARILI: Llama modeli yüklendi ({len(schedulers)} örnek, {load_seconds:.1f}s, ısınma {warmup_seconds:.2f}s).")
     except Exception as e:
         print(f"HATA: Model yüklenirken hata oluştu: {e}")
+        # Hata öncesinde başlatılmış örnekler (thread + yüklü model) sızmasın
+        for scheduler in schedulers:
+            scheduler.stop()
+        llm_scheduler = None
+        model_state.update(status="failed", error=str(e))
+
+def start_model_loading():
+    # Model arka planda yüklenir; bu sırada CRUD uçları hizmet verir
+    thread = threading.Thread(target=load_model, name="model-loader", daemon=True)
+    thread.start()
+    return thread
+
+def require_model_ready():
+    status = model_state["status"]
+    if status in ("ready", "mock"):
+        return
+    if status == "loading":
+        raise HTTPException(
+            status_code=503,
+            detail="Model is loading, retry shortly",
+            headers={"Retry-After": str(MODEL_RETRY_AFTER_SECONDS)}
+        )
+    raise HTTPException(status_code=503, detail=f"Model unavailable: {model_state['error']}")
 
 @app.on_event("startup")
 async def startup_event():
-    load_model()
+    start_model_loading()
+
+@app.on_event("shutdown")
+def shutdown_event():
+    ingest_executor.shutdown(wait=False, cancel_futures=True)
+    upload_io_executor.shutdown(wait=True)
+    if llm_scheduler is not None:
+        llm_scheduler.stop()
+    if ocr_process_pool is not None:
+        ocr_process_pool.shutdown(wait=False, cancel_futures=True)
+    if ocr_backend is not None:
+        ocr_backend.close()
+    extraction_log.stop()
+    db_pool.close()
 
 # --- HELPERS ---
 def clean_json_output(text):
@@ -191,11 +1229,102 @@ def clean_currency(text):
     if any(x in text for x in ['GBP', 'POUND', '£']): return "£"
     return "₺" # Default to TL if totally unknown, or keep text? User asked to default to TL.
 
+# Göçler clean_amount kullandığı için yardımcılardan sonra çalıştırılır
+init_db()
+
+
 
+# --- EXTRACTION LOG ---
+class ExtractionLog:
+    """JSON-lines log of LLM extractions, written off the request path.
+
+    `record()` only serializes the entry and puts it on a bounded queue; a
+    QueueListener thread owns the RotatingFileHandler. Entries are sampled at
+    `sample_rate` (fallback results are always kept) and dropped rather than
+    blocking when the queue is full.
+    """
+
+    def __init__(self, path, enabled=True, sample_rate=1.0, max_bytes=EXTRACTION_LOG_MAX_BYTES,
+                 backups=EXTRACTION_LOG_BACKUPS, include_text=True, queue_size=EXTRACTION_LOG_QUEUE_SIZE):
+        self.path = path
+        self.enabled = enabled
+        self.sample_rate = min(1.0, max(0.0, sample_rate))
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.include_text = include_text
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._listener = None
+        self._handler = None
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.sampled_out = 0
+        self.dropped = 0
+
+    def _start(self):
+        with self._lock:
+            if self._listener is not None:
+                return
+            self._handler = logging.handlers.RotatingFileHandler(
+                self.path, maxBytes=self.max_bytes, backupCount=self.backups, encoding="utf-8", delay=True
+            )
+            self._handler.setFormatter(logging.Formatter("%(message)s"))
+            self._listener = logging.handlers.QueueListener(self._queue, self._handler)
+            self._listener.start()
+
+    def record(self, fields, ocr_text=None, llm_output=None):
+        if not self.enabled:
+            return
+        if not fields.get("fallback") and random.random() >= self.sample_rate:
+            self.sampled_out += 1
+            return
+        if self._listener is None:
+            self._start()
+        entry = {"ts": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="milliseconds"), **fields}
+        if self.include_text:
+            entry["ocr_text"] = ocr_text
+            entry["llm_output"] = llm_output
+        record = logging.makeLogRecord({"msg": json.dumps(entry, ensure_ascii=False)})
+        try:
+            self._queue.put_nowait(record)
+            self.queued += 1
+        except queue.Full:
+            self.dropped += 1
+
+    def stop(self):
+        # Kuyruktaki kayıtlar yazıldıktan sonra döner
+        with self._lock:
+            if self._listener is None:
+                return
+            self._listener.stop()
+            self._handler.close()
+            self._listener = None
+            self._handler = None
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "path": self.path,
+            "sample_rate": self.sample_rate,
+            "queued": self.queued,
+            "sampled_out": self.sampled_out,
+            "dropped": self.dropped,
+            "backlog": self._queue.qsize()
+        }
+
+extraction_log = ExtractionLog(
+    EXTRACTION_LOG_PATH,
+    enabled=EXTRACTION_LOG_ENABLED,
+    sample_rate=EXTRACTION_LOG_SAMPLE_RATE,
+    include_text=EXTRACTION_LOG_INCLUDE_TEXT
+)
+
+MOCK_OCR_TEXT = "MOCK RECEIPT TEXT"
+FALLBACK_LLM_RESULT = {"merchant": "Bilinmiyor", "date": "", "total_amount": "0.00", "tax": "0.00"}
 
 def process_with_llm(ocr_text):
     if llm is None:
         # Mock Response
+        mock_responses.inc(kind="llm")
         return {
             "merchant": "MOCK MARKET",
             "date": "01.01.2024",
@@ -204,90 +1333,1182 @@ def process_with_llm(ocr_text):
             "currency": "₺"
         }
 
-    print(f"DEBUG: OCR Text Length: {len(ocr_text)}")
-    print(f"DEBUG: OCR Text Preview: {ocr_text[:100]}...")
+    llm_input, ocr_tokens, truncated = prepare_llm_input(ocr_text)
+    prompt = build_prompt(llm_input)
+    start = time.perf_counter()
+    kwargs = {"grammar": extraction_grammar} if extraction_grammar is not None else {}
+    output = llm_scheduler.generate(prompt, max_tokens=LLM_MAX_TOKENS, stop=["###"], echo=False, temperature=0.2, top_p=0.9, **kwargs)
+    llm_seconds = time.perf_counter() - start
+    stage_seconds.observe(llm_seconds, stage="llm_call")
+    generated_text = output['choices'][0]['text']
+    parsed_json = clean_json_output(generated_text)
 
-    prompt = f"""Below is an instruction that describes a task, paired with an input that provides further context. Write a response that appropriately completes the request.
+    usage = output.get("usage") or {}
+    completion_tokens = usage.get("completion_tokens")
+    extraction_log.record(
+        {
+            "ocr_chars": len(ocr_text),
+            "prompt_ocr_chars": len(llm_input),
+            "prompt_ocr_tokens": ocr_tokens,
+            "ocr_truncated": truncated,
+            "prompt_tokens": usage.get("prompt_tokens"),
+            "completion_tokens": completion_tokens,
+            # Zamanlayıcı kuyruğunda bekleme süresi dahil
+            "llm_ms": round(llm_seconds * 1000, 1),
+            "tokens_per_second": round(completion_tokens / llm_seconds, 2) if completion_tokens and llm_seconds else None,
+            "llm_pending": llm_scheduler.pending(),
+            "grammar": extraction_grammar is not None,
+            "fallback": not parsed_json
+        },
+        ocr_text=ocr_text,
+        llm_output=generated_text
+    )
 
-### Instruction:
-You are an advanced receipt understanding AI. Analyze the input OCR text and extract the following JSON fields.
+    # Basit bir fallback, eğer LLM boş dönerse
+    if not parsed_json:
+        fallback_results.inc()
+        return dict(FALLBACK_LLM_RESULT)
+        
+    return parsed_json
 
-Rules:
-1. **merchant**: The name of the shop. **ALWAYS** return the very first meaningful line of text as the merchant if no known brand is found.
-2. **date**: The date of the transaction as found on the receipt.
-3. **total_amount**: The final grand total amount.
-4. **tax**: The tax amount (VAT, TAX) if available.
-5. **tax_rate**: The tax rate percentage if available.
-6. **currency**: The currency symbol found on the receipt.
+# --- RESULT CACHE ---
+class LRUCache:
+    """Thread-safe bounded LRU map with hit/miss counters."""
 
-### Reference Examples (Do NOT copy these values):
-Input:
-TARGET STORE
-12.04.2023
-TOTAL 7.50
+    def __init__(self, max_items):
+        self.max_items = max(1, max_items)
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
 
-Response:
-{{
-  "merchant": "TARGET STORE",
-  "date": "12.04.2023",
-  "total_amount": "7.50",
-  "tax": "0.00",
-  "tax_rate": "0",
-  "currency": "$"
-}}
+    def get(self, key):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return None
 
-Input:
-Uber Eats
-Date: Nov 10, 2024
-Total: 25.50
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_items:
+                self._data.popitem(last=False)
 
-Response:
-{{
-  "merchant": "Uber Eats",
-  "date": "10.11.2024",
-  "total_amount": "25.50",
-  "tax": "1.50",
-  "tax_rate": "0",
-  "currency": "$"
-}}
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
 
-### REAL TASK (Analyze the below text):
-Input:
-{ocr_text}
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "max_items": self.max_items,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
 
-### Response:
-"""
-    output = llm(prompt, max_tokens=256, stop=["###"], echo=False, temperature=0.2, top_p=0.9)
-    generated_text = output['choices'][0]['text']
-    print(f"DEBUG: LLM Raw Output: {generated_text}")
-
-    # DEBUG LOGGING TO FILE
-    with open("debug_log.txt", "a", encoding="utf-8") as f:
-        f.write("\n\n--- NEW REQUEST ---\n")
-        f.write(f"OCR TEXT LEN: {len(ocr_text)}\n")
-        f.write(f"OCR TEXT:\n{ocr_text}\n")
-        f.write(f"LLM OUTPUT:\n{generated_text}\n")
-    
-    parsed_json = clean_json_output(generated_text)
-    
-    # Basit bir fallback, eğer LLM boş dönerse
-    if not parsed_json:
-        return {"merchant": "Bilinmiyor", "date": "", "total_amount": "0.00", "tax": "0.00"}
-        
-    return parsed_json
+class ResultCache:
+    """Image-hash -> {"structured_data", "ocr_text"} cache: in-memory LRU in front of SQLite.
+
+    The SQLite tier lives in `result_cache` so hits survive restarts; rows
+    beyond `max_rows` are pruned by least recent hit.
+    """
+
+    PRUNE_EVERY = 100
+
+    def __init__(self, max_items=RESULT_CACHE_MAX_ITEMS, max_rows=RESULT_CACHE_MAX_ROWS):
+        self.memory = LRUCache(max_items)
+        self.max_rows = max_rows
+        self.disk_hits = 0
+        self._puts = 0
+
+    @staticmethod
+    def key_for(data):
+        return hashlib.sha256(data).hexdigest()
+
+    @staticmethod
+    def versioned_key(image_hash):
+        return f"{extraction_version}:{image_hash}"
+
+    def get(self, image_hash):
+        key = self.versioned_key(image_hash)
+        value = self.memory.get(key)
+        if value is not None:
+            return value
+        with db_pool.connection() as conn:
+            c = conn.cursor()
+            c.execute("SELECT structured_data FROM result_cache WHERE key=?", (key,))
+            row = c.fetchone()
+            if row:
+                c.execute("UPDATE result_cache SET last_hit_at=CURRENT_TIMESTAMP WHERE key=?", (key,))
+        if not row:
+            return None
+        value = json.loads(row[0])
+        if "structured_data" not in value:
+            # OCR metni saklanmadan önce yazılmış eski kayıtlar
+            value = {"structured_data": value, "ocr_text": None}
+        self.disk_hits += 1
+        self.memory.put(key, value)
+        return value
+
+    def put(self, image_hash, value):
+        key = self.versioned_key(image_hash)
+        self.memory.put(key, value)
+        with db_pool.connection() as conn:
+            c = conn.cursor()
+            c.execute(
+                "INSERT OR REPLACE INTO result_cache (key, structured_data) VALUES (?, ?)",
+                (key, json.dumps(value, ensure_ascii=False))
+            )
+            self._puts += 1
+            if self._puts % self.PRUNE_EVERY == 0:
+                c.execute("""
+                    DELETE FROM result_cache WHERE key IN (
+                        SELECT key FROM result_cache ORDER BY last_hit_at DESC LIMIT -1 OFFSET ?
+                    )
+                """, (self.max_rows,))
+
+    def clear(self):
+        self.memory.clear()
+        self.disk_hits = 0
+        with db_pool.connection() as conn:
+            conn.execute("DELETE FROM result_cache")
+
+    def stats(self):
+        with db_pool.connection() as conn:
+            rows = conn.execute("SELECT COUNT(*) FROM result_cache").fetchone()[0]
+        memory = self.memory.stats()
+        # Bellekte bulunamayan ama diskte bulunanlar da isabettir
+        hits = memory["hits"] + self.disk_hits
+        lookups = memory["hits"] + memory["misses"]
+        return {
+            "memory": memory,
+            "disk_rows": rows,
+            "disk_hits": self.disk_hits,
+            "hits": hits,
+            "misses": lookups - hits,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0
+        }
+
+class TextResultCache:
+    """Normalized OCR text -> raw LLM output cache, versioned by model and prompt.
+
+    Whitespace is collapsed and case folded so near-identical OCR output of
+    the same receipt maps to one entry. Keys carry `extraction_version`, so a
+    model swap or prompt edit never serves stale entries.
+    """
+
+    def __init__(self, max_items=TEXT_CACHE_MAX_ITEMS):
+        self.memory = LRUCache(max_items)
+
+    @staticmethod
+    def normalize(text):
+        return " ".join(text.split()).casefold()
+
+    def key_for(self, text):
+        digest = hashlib.sha256(self.normalize(text).encode("utf-8")).hexdigest()
+        return f"{extraction_version}:{digest}"
+
+    def get(self, text):
+        value = self.memory.get(self.key_for(text))
+        return dict(value) if value is not None else None
+
+    def put(self, text, data):
+        self.memory.put(self.key_for(text), dict(data))
+
+    def clear(self):
+        self.memory.clear()
+
+    def stats(self):
+        return {"version": extraction_version, **self.memory.stats()}
+
+result_cache = ResultCache()
+text_cache = TextResultCache()
+
+def is_cacheable_result(text, data):
+    # Mock/fallback sonuçlarını önbelleğe alma, model gelince yanlış sonuç döner
+    return llm is not None and text != MOCK_OCR_TEXT and data != FALLBACK_LLM_RESULT
+
+# --- OCR BACKENDS ---
+class PytesseractBackend:
+    """Runs the `tesseract` CLI through pytesseract, one subprocess per image."""
+
+    name = "pytesseract"
+
+    def __init__(self, lang=OCR_LANG):
+        self.lang = lang
+
+    def image_to_string(self, image):
+        return pytesseract.image_to_string(image, lang=self.lang)
+
+    def close(self):
+        pass
+
+class TesserocrBackend:
+    """Keeps one initialized PyTessBaseAPI per worker thread.
+
+    The traineddata is loaded once per thread instead of once per image, which
+    removes process start-up and model load from the per-receipt cost.
+    """
+
+    name = "tesserocr"
+
+    def __init__(self, lang=OCR_LANG, path=TESSDATA_PATH):
+        self.lang = lang
+        self.path = path
+        self._local = threading.local()
+        self._handles = []
+        self._lock = threading.Lock()
+        # Yapılandırma hatalarını ilk istekte değil, seçim sırasında yakala
+        self._api()
+
+    def _api(self):
+        api = getattr(self._local, "api", None)
+        if api is None:
+            kwargs = {"lang": self.lang}
+            if self.path:
+                kwargs["path"] = self.path
+            api = tesserocr.PyTessBaseAPI(**kwargs)
+            self._local.api = api
+            with self._lock:
+                self._handles.append(api)
+        return api
+
+    def image_to_string(self, image):
+        api = self._api()
+        api.SetImage(image)
+        return api.GetUTF8Text()
+
+    def close(self):
+        with self._lock:
+            for api in self._handles:
+                api.End()
+            self._handles.clear()
+
+def create_ocr_backend(name=OCR_BACKEND):
+    if name == "tesserocr":
+        if tesserocr is None:
+            print("UYARI: tesserocr yüklü değil, pytesseract kullanılacak.")
+        else:
+            try:
+                return TesserocrBackend()
+            except Exception as e:
+                print(f"UYARI: tesserocr başlatılamadı ({e}), pytesseract kullanılacak.")
+    elif name != "pytesseract":
+        print(f"UYARI: Bilinmeyen OCR motoru '{name}', pytesseract kullanılacak.")
+    return PytesseractBackend()
+
+ocr_backend = None
+ocr_backend_lock = threading.Lock()
+fallback_ocr_backend = PytesseractBackend()
+
+def get_ocr_backend():
+    # Tembel oluşturma: süreç havuzundaki her işçi kendi motorunu kurar
+    global ocr_backend
+    if ocr_backend is None:
+        with ocr_backend_lock:
+            if ocr_backend is None:
+                ocr_backend = create_ocr_backend()
+    return ocr_backend
+
+# --- RULE-BASED EXTRACTION ---
+# Bilinen zincirler; OCR gürültüsüne karşı normalize edilmiş adla eşleştirilir
+KNOWN_MERCHANTS = [
+    "BIM", "A101", "MIGROS", "SOK", "CARREFOURSA", "FILE", "METRO", "MACROCENTER",
+    "HAKMAR", "ONUR MARKET", "TEKEL SHOP", "STARBUCKS", "KAHVE DUNYASI"
+]
+# OCR'ın sayılarda sık karıştırdığı harfler (synthetic_data_gen.generate_noise ile aynı)
+DIGIT_FIXES = str.maketrans("OoIlBSZ", "0011852")
+LETTER_FIXES = str.maketrans("0158Z2ŞİĞÇÖÜ", "OISBZZSIGCOU")
+AMOUNT_RE = re.compile(r"(?<![A-Za-z0-9])[0-9OoIlBSZ][0-9OoIlBSZ.,]*[.,][0-9OoIlBSZ]{2}(?![0-9])")
+DATE_RE = re.compile(r"(?<![0-9])([0-9OIlBSZ]{2})[./-]([0-9OIlBSZ]{2})[./-]([0-9OIlBSZ]{4})(?![0-9])")
+ISO_DATE_RE = re.compile(r"(?<![0-9])(\d{4})-(\d{2})-(\d{2})(?![0-9])")
+TOTAL_RE = re.compile(r"\b(?:GENEL\s+)?(?:T[O0]PLAM|T[O0]TAL|TUTAR)\b", re.IGNORECASE)
+NOT_TOTAL_RE = re.compile(r"\b(?:ARA\s*T[O0]PLAM|SUB\s*T[O0]TAL|T[O0]PLAM\s+KDV|KDV\s+T[O0]PLAM|T[O0]PKDV)\b", re.IGNORECASE)
+TAX_RE = re.compile(r"\b(?:KDV|VAT|TAX)\b", re.IGNORECASE)
+TAX_TOTAL_RE = re.compile(r"\b(?:T[O0]PLAM\s+KDV|KDV\s+T[O0]PLAM|T[O0]PKDV|TOTAL\s+(?:VAT|TAX))\b", re.IGNORECASE)
+TAX_RATE_RE = re.compile(r"%\s*([0-9OIlBSZ]{1,2})(?![0-9])|(?<![0-9.,])([0-9]{1,2})\s*%")
+CURRENCY_MARKERS = [("₺", ("₺", "TL", "TRY")), ("$", ("$", "USD")), ("€", ("€", "EUR")), ("£", ("£", "GBP"))]
+
+def parse_amount(token):
+    # (Decimal, düzeltildi mi) veya None; son ayraç ondalık ayracıdır
+    fixed = token.translate(DIGIT_FIXES)
+    integer, fraction = fixed[:-3], fixed[-2:]
+    # Binlik ayraçlar sadece 3 haneli gruplar arasında olabilir ("2,.51" bozuktur)
+    if not fraction.isdigit() or not re.fullmatch(r"\d+|\d{1,3}(?:[.,]\d{3})+", integer):
+        return None
+    return Decimal(f"{re.sub(r'[.,]', '', integer)}.{fraction}"), fixed != token
+
+def amount_after(line, pos):
+    # Anahtar kelimeden sonraki ilk tutar; OCR satırları birleştirmiş olabilir
+    match = AMOUNT_RE.search(line, pos)
+    if not match:
+        return pos, None
+    if match.start() > 0 and line[match.start() - 1] in ".,-":
+        # "-4.91" gibi: baştaki rakam büyük olasılıkla noktalama olarak okunmuş
+        return match.end(), None
+    return match.end(), parse_amount(match.group())
+
+def extract_merchant(lines):
+    for line in lines[:3]:
+        name = re.sub(r"[^\w\s]", " ", line).strip()
+        if not any(ch.isalpha() for ch in name) or sum(ch.isalnum() for ch in name) < 2:
+            continue
+        key = re.sub(r"\s+", " ", name.upper().translate(LETTER_FIXES))
+        for merchant in KNOWN_MERCHANTS:
+            if key == merchant.translate(LETTER_FIXES):
+                return merchant, 0.95
+        # İlk anlamlı satır; marka bilinmediği için model doğrulasın
+        return re.sub(r"\s+", " ", name), 0.5
+    return "", 0.0
+
+def extract_date(text):
+    found = []
+    for day, month, year in DATE_RE.findall(text):
+        try:
+            found.append(datetime.date(int(year.translate(DIGIT_FIXES)), int(month.translate(DIGIT_FIXES)), int(day.translate(DIGIT_FIXES))))
+        except ValueError:
+            continue
+    for year, month, day in ISO_DATE_RE.findall(text):
+        try:
+            found.append(datetime.date(int(year), int(month), int(day)))
+        except ValueError:
+            continue
+    distinct = set(found)
+    if not distinct:
+        return "", 0.0
+    # Birden fazla farklı tarih (ör. son kullanma) varsa ilki ama düşük güvenle
+    return found[0].strftime("%d.%m.%Y"), 0.95 if len(distinct) == 1 else 0.5
+
+def extract_total(lines):
+    candidates = []
+    item_sum = Decimal("0")
+    for line in lines:
+        match = TOTAL_RE.search(line)
+        if match and not NOT_TOTAL_RE.search(line):
+            parsed = amount_after(line, match.end())[1]
+            if parsed is not None:
+                candidates.append(parsed)
+        elif not candidates and not TAX_RE.search(line):
+            # Toplamdan önceki kalem satırları
+            for token in AMOUNT_RE.findall(line):
+                parsed = parse_amount(token)
+                if parsed is not None:
+                    item_sum += parsed[0]
+    values = {amount for amount, _ in candidates}
+    if not values:
+        return "0.00", 0.0
+    amount, corrected = candidates[-1]
+    if len(values) > 1:
+        return f"{amount:.2f}", 0.4
+    # Kalemlerin toplamı tutuyorsa en yüksek güven
+    if item_sum == amount:
+        return f"{amount:.2f}", 0.99
+    return f"{amount:.2f}", 0.85 if corrected else 0.9
+
+def extract_tax(lines):
+    """Returns (tax, tax_rate, tax_confidence, tax_rate_confidence)."""
+    rates = []
+    total = Decimal("0")
+    explicit_total = None
+    corrected = False
+    unreadable = False
+    # Tutarı sayılan ama oranı okunamayan KDV satırı varsa oran listesi eksiktir
+    rate_missing = False
+    rate_corrected = False
+    for line in lines:
+        if not TAX_RE.search(line):
+            # "K.V %8: 81.19": anahtar kelimesi bozulmuş bir KDV satırı
+            unreadable = unreadable or bool(TAX_RATE_RE.search(line) and AMOUNT_RE.search(line))
+            continue
+        pos = 0
+        for match in TAX_RE.finditer(line):
+            if match.start() < pos:
+                continue
+            pos, parsed = amount_after(line, match.end())
+            if parsed is None:
+                unreadable = True
+                continue
+            window = line[max(0, match.start() - 12):pos]
+            if TAX_TOTAL_RE.search(window):
+                explicit_total = parsed[0]
+                continue
+            total += parsed[0]
+            corrected = corrected or parsed[1]
+            rate_match = TAX_RATE_RE.search(line, match.end(), pos)
+            if not rate_match:
+                rate_missing = True
+                continue
+            raw_rate = rate_match.group(1) or rate_match.group(2)
+            rate_corrected = rate_corrected or raw_rate != raw_rate.translate(DIGIT_FIXES)
+            rate = int(raw_rate.translate(DIGIT_FIXES))
+            if rate not in rates:
+                rates.append(rate)
+    tax_rate = ", ".join(f"%{rate}" for rate in rates)
+    if unreadable or rate_missing:
+        rate_conf = 0.5
+    elif not rates:
+        rate_conf = 0.3
+    else:
+        rate_conf = 0.85 if rate_corrected else 0.9
+    if explicit_total is not None:
+        return f"{explicit_total:.2f}", tax_rate, 0.95, rate_conf
+    if unreadable:
+        return f"{total:.2f}", tax_rate, 0.5, rate_conf
+    if total == 0:
+        # KDV satırı yok: gerçekten vergisiz mi yoksa okunamadı mı bilinmez
+        return "0.00", "", 0.3, 0.3
+    return f"{total:.2f}", tax_rate, 0.85 if corrected else 0.9, rate_conf
+
+def extract_currency(text):
+    upper = text.upper()
+    for symbol, markers in CURRENCY_MARKERS:
+        if any(re.search(rf"(?<![A-Z]){re.escape(marker)}(?![A-Z])", upper) for marker in markers):
+            return symbol, 0.95
+    if re.search(r"\b(?:KDV|T[O0]PLAM|TARIH|FIS)\b", upper):
+        # Türkçe fiş, sembol basılmamış
+        return "₺", 0.85
+    return "₺", 0.3
+
+def rule_based_extract(text):
+    """Deterministic extraction for well-formed receipts.
+
+    Returns (data, confidence) where `data` has the same keys as the LLM output
+    and `confidence` maps each field to a score in [0, 1].
+    """
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    merchant, merchant_conf = extract_merchant(lines)
+    date, date_conf = extract_date(text)
+    total, total_conf = extract_total(lines)
+    tax, tax_rate, tax_conf, tax_rate_conf = extract_tax(lines)
+    currency, currency_conf = extract_currency(text)
+    data = {
+        "merchant": merchant,
+        "date": date,
+        "total_amount": total,
+        "tax": tax,
+        "tax_rate": tax_rate,
+        "currency": currency
+    }
+    confidence = {
+        "merchant": merchant_conf,
+        "date": date_conf,
+        "total_amount": total_conf,
+        "tax": tax_conf,
+        "tax_rate": tax_rate_conf,
+        "currency": currency_conf
+    }
+    return data, confidence
+
+class ExtractionPathStats:
+    """Counts which path (rules or LLM) produced each extraction."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.paths = {"rules": 0, "llm": 0}
+        # Kural yolunu eşiğin altında kalarak engelleyen alanlar
+        self.low_confidence = {field: 0 for field in EXTRACTION_FIELDS}
+
+    def record(self, path, confidence=None):
+        with self._lock:
+            self.paths[path] += 1
+            if path == "llm" and confidence:
+                for field, score in confidence.items():
+                    if score < RULE_EXTRACT_THRESHOLD:
+                        self.low_confidence[field] += 1
+
+    def stats(self):
+        with self._lock:
+            total = sum(self.paths.values())
+            return {
+                "enabled": RULE_EXTRACT_ENABLED,
+                "threshold": RULE_EXTRACT_THRESHOLD,
+                **self.paths,
+                "rule_share": round(self.paths["rules"] / total, 4) if total else 0.0,
+                "low_confidence_fields": dict(self.low_confidence)
+            }
+
+extraction_paths = ExtractionPathStats()
+
+# --- OCR TEXT COMPACTION ---
+# Prompt değerlendirmesi token sayısıyla büyür; ayraç satırları, boşluklar ve uzun
+# kalem listeleri modele bilgi katmadan süreyi uzatır.
+NOISE_LINE_RE = re.compile(r"^[\W_]*$|^(?:[\W_]*\w[\W_]*)$")
+SEPARATOR_RUN_RE = re.compile(r"([-=_*.])\1{2,}")
+
+def compact_ocr_text(text, max_lines=None, head_lines=None, tail_context=None):
+    """Drop separator/blank lines, collapse whitespace and repeated headers.
+
+    Receipts longer than `max_lines` keep their first `head_lines` lines and the
+    totals region (from `tail_context` lines before the first TOPLAM/KDV line
+    on, so a total whose keyword OCR garbled is kept); the item list in between
+    is replaced by a one-line marker.
+    """
+    max_lines = OCR_COMPACT_MAX_LINES if max_lines is None else max_lines
+    head_lines = OCR_COMPACT_HEAD_LINES if head_lines is None else head_lines
+    tail_context = OCR_COMPACT_TAIL_CONTEXT if tail_context is None else tail_context
+    lines = []
+    seen = set()
+    for raw in text.splitlines():
+        line = re.sub(r"\s+", " ", SEPARATOR_RUN_RE.sub(" ", raw)).strip()
+        if NOISE_LINE_RE.match(line):
+            continue
+        # Tutar içermeyen tekrarlar (sayfa başlıkları vb.) bir kez yeter;
+        # aynı kalem iki kez alınmış olabileceği için tutarlı satırlar kalır
+        if not AMOUNT_RE.search(line):
+            key = line.upper()
+            if key in seen:
+                continue
+            seen.add(key)
+        lines.append(line)
+
+    if len(lines) <= max_lines:
+        return "\n".join(lines)
+    tail_start = next(
+        (i for i in range(head_lines, len(lines)) if TOTAL_RE.search(lines[i]) or TAX_RE.search(lines[i])),
+        len(lines)
+    )
+    if tail_start < len(lines):
+        tail_start = max(head_lines, tail_start - tail_context)
+    tail_budget = max(1, max_lines - head_lines - 1)
+    tail = lines[tail_start:][:tail_budget] if tail_start < len(lines) else lines[-tail_budget:]
+    tail_start = min(tail_start, len(lines) - len(tail))
+    omitted = tail_start - head_lines
+    if omitted <= 0:
+        return "\n".join(lines[:max_lines])
+    return "\n".join(lines[:head_lines] + [f"[... {omitted} lines omitted ...]"] + tail)
+
+def fit_token_budget(text, budget, count_tokens):
+    """Trim the middle of `text` until it is at most `budget` tokens.
+
+    Returns (text, tokens, truncated). `count_tokens` is the model tokenizer.
+    """
+    tokens = count_tokens(text)
+    if tokens <= budget:
+        return text, tokens, False
+    lines = text.splitlines()
+    while tokens > budget and len(lines) > 2:
+        # Fazlalıkla orantılı sayıda satır ortadan atılır, baş ve toplamlar kalır
+        cut = min(len(lines) - 2, max(1, len(lines) * (tokens - budget) // tokens + 1))
+        start = (len(lines) - cut) // 2
+        lines = lines[:start] + lines[start + cut:]
+        text = "\n".join(lines)
+        tokens = count_tokens(text)
+    while tokens > budget and text:
+        text = text[:len(text) * budget // tokens]
+        tokens = count_tokens(text)
+    return text, tokens, True
+
+def prepare_llm_input(ocr_text):
+    # (metin, ocr token sayısı veya None, kesildi mi)
+    text = compact_ocr_text(ocr_text) if OCR_COMPACT else ocr_text
+    if llm is None or ocr_token_budget is None:
+        return text, None, False
+    return fit_token_budget(text, ocr_token_budget, count_llm_tokens)
+
+# --- INGESTION PIPELINE ---
+def run_ocr(image):
+    try:
+        backend = get_ocr_backend()
+        try:
+            return backend.image_to_string(image)
+        except Exception as backend_err:
+            if isinstance(backend, PytesseractBackend):
+                raise
+            print(f"UYARI: {backend.name} başarısız ({backend_err}), pytesseract deneniyor.")
+            return fallback_ocr_backend.image_to_string(image)
+    except pytesseract.TesseractNotFoundError:
+        # Fallback for dev env without tesseract
+        print("HATA: Tesseract OCR bulunamadı! Mock modunda devam ediliyor.")
+        return MOCK_OCR_TEXT
+    except Exception as ocr_err:
+        print(f"HATA: OCR işlemi başarısız: {ocr_err}")
+        return MOCK_OCR_TEXT
+
+def build_structured_data(data):
+    # Veriyi Hazırla (DB'ye KAYDETME YOK)
+    return {
+        "merchant": data.get("merchant", "Bilinmiyor"),
+        "date": data.get("date", ""),
+        # Clean amounts
+        "total_amount": clean_amount(data.get("total_amount", "0.00")),
+        "tax": clean_amount(data.get("tax", "0.00")),
+        "tax_rate": data.get("tax_rate", ""),
+        "currency": clean_currency(data.get("currency", "₺"))
+    }
+
+def preprocess_image(image, target_width=None, binarize=None):
+    """Prepare a phone photo for Tesseract.
+
+    Applies the EXIF orientation, downscales to `target_width` pixels (receipts
+    need roughly 300 DPI, not 12MP), converts to grayscale and optionally
+    binarizes against the local mean so uneven lighting does not wash out text.
+    """
+    target_width = OCR_TARGET_WIDTH if target_width is None else target_width
+    binarize = OCR_BINARIZE if binarize is None else binarize
+
+    # JPEG için draft, tam çözünürlükte decode etmeden küçültülmüş okur
+    if target_width and image.format == "JPEG" and image.width > target_width:
+        scale = target_width / image.width
+        image.draft("L", (target_width, int(image.height * scale)))
+
+    image = ImageOps.exif_transpose(image)
+    image = image.convert("L")
+
+    if target_width and image.width > target_width:
+        height = max(1, round(image.height * target_width / image.width))
+        image = image.resize((target_width, height), Image.LANCZOS)
+
+    if binarize:
+        # Adaptif eşikleme: yerel ortalamadan OFFSET kadar koyu pikseller metindir
+        local_mean = image.filter(ImageFilter.BoxBlur(OCR_BINARIZE_RADIUS))
+        darkness = ImageChops.subtract(local_mean, image)
+        image = darkness.point(lambda v: 0 if v > OCR_BINARIZE_OFFSET else 255)
+
+    return image
+
+def ocr_image_bytes(data, preprocess=None):
+    # Süreç havuzunda da çalışır, bu yüzden modül seviyesinde ve picklable olmalı
+    try:
+        image = Image.open(io.BytesIO(data))
+    except UnidentifiedImageError:
+        raise ValueError("Unsupported or corrupt image file")
+    if OCR_PREPROCESS if preprocess is None else preprocess:
+        image = preprocess_image(image)
+    return run_ocr(image)
+
+def cached_process_with_llm(text):
+    data = text_cache.get(text)
+    if data is not None:
+        return data
+    data = process_with_llm(text)
+    if is_cacheable_result(text, data):
+        text_cache.put(text, data)
+    return data
+
+def extract_fields(text):
+    # (data, path): güvenli kural sonucu varsa modeli hiç bekletme
+    confidence = None
+    if RULE_EXTRACT_ENABLED and text != MOCK_OCR_TEXT:
+        data, confidence = rule_based_extract(text)
+        if min(confidence.values()) >= RULE_EXTRACT_THRESHOLD:
+            extraction_paths.record("rules")
+            return data, "rules"
+    extraction_paths.record("llm", confidence)
+    return cached_process_with_llm(text), "llm"
+
+def extract_structured_data(text, image_hash=None):
+    if text == MOCK_OCR_TEXT:
+        mock_responses.inc(kind="ocr")
+    start = time.perf_counter()
+    data, path = extract_fields(text)
+    stage_seconds.observe(time.perf_counter() - start, stage=f"extract_{path}")
+    with stage_seconds.time(stage="postprocess"):
+        structured_data = build_structured_data(data)
+    # Kural sonucu deterministiktir, model olmasa da önbelleğe alınabilir
+    cacheable = path == "rules" or is_cacheable_result(text, data)
+    if image_hash and cacheable:
+        result_cache.put(image_hash, {"structured_data": structured_data, "ocr_text": text})
+    return structured_data
+
+def write_upload(file_path, data):
+    with stage_seconds.time(stage="upload_save"), open(file_path, "wb") as buffer:
+        buffer.write(data)
+
+def process_receipt_bytes(data, unique_filename, image_hash=None, save_future=None):
+    # Dosya yazımı (save_future) OCR ile paralel yürür; sonuç dönmeden önce beklenir
+    with stage_seconds.time(stage="ocr"):
+        text = ocr_image_bytes(data)
+    structured_data = extract_structured_data(text, image_hash)
+    if save_future is not None:
+        save_future.result()
+    return {
+        "filename": unique_filename,
+        "image_url": f"/static/{unique_filename}",
+        "structured_data": structured_data,
+        "ocr_text": text
+    }
+
+ocr_process_pool = None
+ocr_process_pool_lock = threading.Lock()
+
+def get_ocr_process_pool():
+    # Tembel oluşturma: Windows'ta (spawn) import sırasında süreç başlatmamak için
+    global ocr_process_pool
+    with ocr_process_pool_lock:
+        if ocr_process_pool is None:
+            # fork yerine forkserver/spawn: bu noktada model, havuz ve log thread'leri çalışıyor;
+            # çok thread'li süreci fork'lamak miras kalan kilitlerde kilitlenebilir
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            ocr_process_pool = ProcessPoolExecutor(
+                max_workers=max(1, OCR_PROCESSES),
+                mp_context=multiprocessing.get_context(method)
+            )
+        return ocr_process_pool
+
+# --- PROFILING ---
+PROFILE_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+PROFILE_SORT_KEYS = ("cumulative", "tottime", "calls", "ncalls")
+
+class ProfileStore:
+    """Bounded on-disk store of cProfile dumps (`<id>.prof`) with JSON metadata (`<id>.json`).
+
+    Only the newest `max_files` profiles are kept.
+    """
+
+    def __init__(self, directory, max_files=PROFILE_MAX_FILES):
+        self.directory = Path(directory)
+        self.max_files = max(1, max_files)
+        self._lock = threading.Lock()
+
+    def save(self, profiler, **meta):
+        profile_id = uuid.uuid4().hex
+        stats = pstats.Stats(profiler)
+        meta = {
+            "id": profile_id,
+            "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="milliseconds"),
+            "total_seconds": round(stats.total_tt, 6),
+            "function_calls": stats.total_calls,
+            **meta
+        }
+        with self._lock:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            stats.dump_stats(str(self.directory / f"{profile_id}.prof"))
+            (self.directory / f"{profile_id}.json").write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+            self._prune()
+        return profile_id
+
+    def _prune(self):
+        metas = sorted(self.directory.glob("*.json"), key=lambda p: p.stat().st_mtime, reverse=True)
+        for stale in metas[self.max_files:]:
+            stale.unlink(missing_ok=True)
+            stale.with_suffix(".prof").unlink(missing_ok=True)
+
+    def list(self):
+        if not self.directory.exists():
+            return []
+        profiles = []
+        for path in self.directory.glob("*.json"):
+            try:
+                profiles.append(json.loads(path.read_text(encoding="utf-8")))
+            except (OSError, ValueError):
+                continue
+        return sorted(profiles, key=lambda m: m["created_at"], reverse=True)
+
+    def path_for(self, profile_id):
+        if not PROFILE_ID_RE.match(profile_id):
+            return None
+        path = self.directory / f"{profile_id}.prof"
+        return path if path.exists() else None
+
+    def report(self, profile_id, sort="cumulative", limit=50):
+        path = self.path_for(profile_id)
+        if path is None:
+            return None
+        out = io.StringIO()
+        pstats.Stats(str(path), stream=out).strip_dirs().sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+profile_store = ProfileStore(PROFILE_DIR)
+
+def profiling_trigger(request):
+    # "header"/"query" (açıkça istendi), "sampled" veya None
+    if PROFILING_ENABLED:
+        requested = request.headers.get("X-Spendify-Profile") or request.query_params.get("profile")
+        if requested and requested != "0":
+            # Jeton tanımlıysa istek onu taşımalı
+            if PROFILING_TOKEN and requested != PROFILING_TOKEN:
+                raise HTTPException(status_code=403, detail="Invalid profiling token")
+            return "header" if request.headers.get("X-Spendify-Profile") else "query"
+    if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        return "sampled"
+    return None
+
+# Aynı anda yalnızca bir profil çalışır (Python 3.12+ ikinci profilleyiciyi reddeder)
+profiling_lock = threading.Lock()
+
+@contextmanager
+def maybe_profile(trigger, result_holder, **meta):
+    """Run the block under cProfile when `trigger` is set and store the profile.
+
+    Only one profile runs at a time; while one is active other triggered or
+    sampled requests run unprofiled. Before Python 3.12 cProfile only sees the
+    current thread, so LLM generation on the scheduler thread shows up as time
+    waiting on its future. From 3.12 it records every thread, so work of other
+    requests running concurrently is mixed into the profile.
+    """
+    if trigger is None or not profiling_lock.acquire(blocking=False):
+        yield
+        return
+    try:
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError as e:
+            # Başka bir profil aracı (ör. hata ayıklayıcı) zaten etkin
+            print(f"UYARI: Profil başlatılamadı: {e}")
+            profiler = None
+        try:
+            yield
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                try:
+                    profile_id = profile_store.save(profiler, trigger=trigger, **meta)
+                    result_holder["profile_id"] = profile_id
+                except OSError as e:
+                    print(f"UYARI: Profil kaydedilemedi: {e}")
+    finally:
+        profiling_lock.release()
+
+# --- INGESTION JOBS ---
+# OCR ve LLM çağrıları bloklayıcıdır; sınırlı bir işçi havuzunda çalıştırılır.
+ingest_executor = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix="ingest")
+# Yüklenen dosyaların diske yazımı event loop dışında yapılır
+upload_io_executor = ThreadPoolExecutor(max_workers=UPLOAD_IO_WORKERS, thread_name_prefix="upload-io")
+jobs = OrderedDict()
+jobs_lock = threading.Lock()
+
+def _update_job(job_id, **fields):
+    with jobs_lock:
+        job = jobs.get(job_id)
+        if job is not None:
+            job.update(fields)
+
+def _prune_jobs():
+    # Bitmiş en eski işleri at, bekleyen/çalışan işlere dokunma
+    overflow = len(jobs) - JOB_HISTORY_LIMIT
+    if overflow <= 0:
+        return
+    for job_id in [k for k, v in jobs.items() if v["status"] in ("done", "failed")][:overflow]:
+        del jobs[job_id]
+
+def _run_ingest_job(job_id, data, unique_filename, image_hash, save_future, profile_trigger=None):
+    _update_job(job_id, status="running", started_at=time.time())
+    profile = {}
+    try:
+        with maybe_profile(profile_trigger, profile, endpoint="/upload", job_id=job_id, filename=unique_filename, bytes=len(data)):
+            result = process_receipt_bytes(data, unique_filename, image_hash, save_future)
+        result.update(profile)
+    except Exception as e:
+        print(f"HATA: İş {job_id} başarısız: {e}")
+        _update_job(job_id, status="failed", error=str(e), finished_at=time.time())
+        raise
+    _update_job(job_id, status="done", result=result, finished_at=time.time())
+    return result
+
+def _new_job(job_id, unique_filename, **fields):
+    job = {
+        "id": job_id,
+        "status": "queued",
+        "filename": unique_filename,
+        "image_url": f"/static/{unique_filename}",
+        "created_at": time.time(),
+        "started_at": None,
+        "finished_at": None,
+        "result": None,
+        "error": None
+    }
+    job.update(fields)
+    jobs[job_id] = job
+    _prune_jobs()
+
+def submit_ingest_job(data, unique_filename, image_hash=None, save_future=None, profile_trigger=None):
+    with jobs_lock:
+        pending = sum(1 for j in jobs.values() if j["status"] in ("queued", "running"))
+        if pending >= MAX_PENDING_JOBS:
+            raise HTTPException(status_code=503, detail="Ingestion queue is full, try again later")
+        job_id = str(uuid.uuid4())
+        _new_job(job_id, unique_filename)
+    future = ingest_executor.submit(_run_ingest_job, job_id, data, unique_filename, image_hash, save_future, profile_trigger)
+    return job_id, future
+
+def record_completed_job(unique_filename, result):
+    # Önbellekten dönen sonuçlar için işçi havuzuna gitmeden tamamlanmış iş kaydı
+    now = time.time()
+    with jobs_lock:
+        job_id = str(uuid.uuid4())
+        _new_job(job_id, unique_filename, status="done", started_at=now, finished_at=now, result=result)
+    return job_id
+
+def get_job_snapshot(job_id):
+    with jobs_lock:
+        job = jobs.get(job_id)
+        return dict(job) if job is not None else None
 
 # --- API ENDPOINTS ---
 
+RECEIPT_COLUMNS = (
+    "id", "filename", "merchant", "date", "total", "tax", "category",
+    "tax_rate", "status", "image_url", "created_at", "currency",
+    "total_minor", "tax_minor", "date_iso"
+)
+# Büyük olabileceği için sadece fields ile açıkça istenirse döner
+RECEIPT_OPTIONAL_COLUMNS = ("ocr_text",)
+
+def encode_cursor(created_at, receipt_id):
+    raw = json.dumps([created_at, receipt_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+def decode_cursor(cursor):
+    try:
+        created_at, receipt_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return created_at, receipt_id
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
 @app.get("/receipts")
-def get_receipts():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute("SELECT * FROM receipts ORDER BY created_at DESC")
-    rows = c.fetchall()
-    conn.close()
+def get_receipts(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    created_from: Optional[str] = None,
+    created_to: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    category: Optional[str] = None,
+    merchant: Optional[str] = None
+):
+    # Parametresiz çağrı eskisi gibi tüm listeyi döner; limit verilirse
+    # (created_at, id) üzerinden keyset sayfalama yapılır ve sonraki sayfanın
+    # imleci X-Next-Cursor başlığında döner.
+    if fields:
+        requested = [f.strip() for f in fields.split(",") if f.strip()]
+        unknown = [f for f in requested if f not in RECEIPT_COLUMNS + RECEIPT_OPTIONAL_COLUMNS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+        columns = list(dict.fromkeys(["id", "created_at"] + requested))
+    else:
+        columns = list(RECEIPT_COLUMNS)
+
+    where = []
+    params = []
+    if category is not None:
+        where.append("category = ?")
+        params.append(category)
+    if merchant is not None:
+        where.append("merchant = ?")
+        params.append(merchant)
+    if created_from is not None:
+        where.append("created_at >= ?")
+        params.append(created_from)
+    if created_to is not None:
+        where.append("created_at <= ?")
+        params.append(created_to)
+    # Fiş tarihi (ISO, YYYY-MM-DD) aralığı
+    if date_from is not None:
+        where.append("date_iso >= ?")
+        params.append(date_from)
+    if date_to is not None:
+        where.append("date_iso <= ?")
+        params.append(date_to)
+    if cursor is not None:
+        where.append("(created_at, id) < (?, ?)")
+        params.extend(decode_cursor(cursor))
+
+    query = f"SELECT {', '.join(columns)} FROM receipts"
+    if where:
+        query += " WHERE " + " AND ".join(where)
+    query += " ORDER BY created_at DESC, id DESC"
+    if limit is not None:
+        # Bir fazla satır çekerek sonraki sayfanın varlığını anla
+        query += " LIMIT ?"
+        params.append(limit + 1)
+
+    with db_pool.connection() as conn:
+        rows = conn.execute(query, params).fetchall()
+
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(rows[-1]["created_at"], rows[-1]["id"])
     return [dict(row) for row in rows]
 
+SEARCH_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+def build_fts_query(q):
+    # Her kelime önek araması olur ve hepsi eşleşmeli: "migros süt" -> "migros"* "süt"*
+    tokens = SEARCH_TOKEN_RE.findall(q)
+    return " ".join(f'"{token}"*' for token in tokens)
+
+@app.get("/receipts/search")
+def search_receipts(
+    q: str,
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0)
+):
+    match = build_fts_query(q)
+    if not match:
+        return {"query": q, "results": [], "limit": limit, "offset": offset, "next_offset": None}
+
+    columns = ", ".join(f"r.{col}" for col in RECEIPT_COLUMNS)
+    with db_pool.connection() as conn:
+        rows = conn.execute(f"""
+            SELECT {columns},
+                   snippet(receipts_fts, 2, '[', ']', '…', 8) AS ocr_snippet,
+                   bm25(receipts_fts, 10.0, 3.0, 1.0) AS score
+            FROM receipts_fts
+            JOIN receipts r ON r.rowid = receipts_fts.rowid
+            WHERE receipts_fts MATCH ?
+            ORDER BY score
+            LIMIT ? OFFSET ?
+        """, (match, limit + 1, offset)).fetchall()
+
+    has_more = len(rows) > limit
+    return {
+        "query": q,
+        "results": [dict(row) for row in rows[:limit]],
+        "limit": limit,
+        "offset": offset,
+        "next_offset": offset + limit if has_more else None
+    }
+
+# --- STATS ---
+STATS_RANGES = {"30d": ("days", 30), "3m": ("months", 3), "6m": ("months", 6), "1y": ("months", 12)}
+STATS_BUCKETS = ("day", "month")
+
+def _shift_months(day, months):
+    year, month = divmod(day.month - 1 + months, 12)
+    year += day.year
+    month += 1
+    return day.replace(year=year, month=month, day=min(day.day, calendar.monthrange(year, month)[1]))
+
+def _bucket_keys(start, end, bucket):
+    # Boş günler/aylar da grafikte sıfır olarak görünsün
+    keys = []
+    if bucket == "day":
+        day = start
+        while day <= end:
+            keys.append(day.isoformat())
+            day += datetime.timedelta(days=1)
+    else:
+        month = start.replace(day=1)
+        while month <= end:
+            keys.append(month.isoformat()[:7])
+            month = _shift_months(month, 1)
+    return keys
+
+@app.get("/stats")
+def get_stats(
+    period: str = Query("30d", alias="range"),
+    currency: str = "₺",
+    bucket: Optional[str] = None
+):
+    if period not in STATS_RANGES:
+        raise HTTPException(status_code=400, detail=f"range must be one of {', '.join(STATS_RANGES)}")
+    bucket = bucket or ("day" if period == "30d" else "month")
+    if bucket not in STATS_BUCKETS:
+        raise HTTPException(status_code=400, detail=f"bucket must be one of {', '.join(STATS_BUCKETS)}")
+
+    today = datetime.date.today()
+    unit, amount = STATS_RANGES[period]
+    # Dönem bugün dahil: 30d son 30 gün, 3m bu ay dahil son 3 takvim ayı (3 ay kovası)
+    if unit == "days":
+        start = today - datetime.timedelta(days=amount - 1)
+    else:
+        start = _shift_months(today.replace(day=1), -(amount - 1))
+    # Karşılaştırma dönemi aynı gün sayısında ve mevcut dönemin başladığı günden hemen önce biter
+    prev_start = start - (today - start + datetime.timedelta(days=1))
+    prev_end = start - datetime.timedelta(days=1)
+    start_iso, end_iso, prev_start_iso = start.isoformat(), today.isoformat(), prev_start.isoformat()
+
+    # Toplamlar, kategoriler ve trend önceden toplanmış tablolardan okunur;
+    # sadece en büyük harcamalar için receipts taranır (date_iso indeksi).
+    with db_pool.connection() as conn:
+        c = conn.cursor()
+
+        c.execute("""
+            SELECT
+                COALESCE(SUM(CASE WHEN day >= ? THEN total_minor END), 0) / 100.0 AS total_spent,
+                COALESCE(SUM(CASE WHEN day >= ? THEN receipt_count END), 0) AS count,
+                COALESCE(SUM(CASE WHEN day < ? THEN total_minor END), 0) / 100.0 AS previous_total_spent
+            FROM spend_daily
+            WHERE currency = ? AND day >= ? AND day <= ?
+        """, (start_iso, start_iso, start_iso, currency, prev_start_iso, end_iso))
+        totals = c.fetchone()
+
+        c.execute("""
+            SELECT category AS name, SUM(total_minor) / 100.0 AS value
+            FROM spend_daily
+            WHERE currency = ? AND day >= ? AND day <= ?
+            GROUP BY category
+            ORDER BY value DESC
+        """, (currency, start_iso, end_iso))
+        categories = c.fetchall()
+
+        c.execute(f"""
+            SELECT id, merchant, date, total, category, currency
+            FROM receipts
+            WHERE date_iso >= ? AND date_iso <= ? AND {ROLLUP_CURRENCY_SQL} = ?
+            ORDER BY total_minor DESC
+            LIMIT 5
+        """, (start_iso, end_iso, currency))
+        largest = c.fetchall()
+
+        if bucket == "day":
+            c.execute("""
+                SELECT day AS bucket_key, SUM(total_minor) / 100.0 AS value
+                FROM spend_daily
+                WHERE currency = ? AND day >= ? AND day <= ?
+                GROUP BY day
+            """, (currency, start_iso, end_iso))
+        else:
+            # Tam aylar aylık tablodan, kısmi ilk/son ay günlük tablodan
+            first_full = _shift_months(start.replace(day=1), 1).isoformat()[:7]
+            last_full = _shift_months(today.replace(day=1), -1).isoformat()[:7]
+            c.execute("""
+                SELECT month AS bucket_key, SUM(total_minor) / 100.0 AS value
+                FROM spend_monthly
+                WHERE currency = ? AND month >= ? AND month <= ?
+                GROUP BY month
+                UNION ALL
+                SELECT substr(day, 1, 7) AS bucket_key, SUM(total_minor) / 100.0 AS value
+                FROM spend_daily
+                WHERE currency = ? AND day >= ? AND day <= ?
+                  AND (substr(day, 1, 7) < ? OR substr(day, 1, 7) > ?)
+                GROUP BY bucket_key
+            """, (currency, first_full, last_full, currency, start_iso, end_iso, first_full, last_full))
+        trend_values = {}
+        for row in c.fetchall():
+            trend_values[row["bucket_key"]] = trend_values.get(row["bucket_key"], 0) + row["value"]
+
+    total_spent = totals["total_spent"]
+    previous_total = totals["previous_total_spent"]
+    count = totals["count"]
+    return {
+        "range": period,
+        "currency": currency,
+        "bucket": bucket,
+        "period": {"start": start_iso, "end": end_iso},
+        "previous_period": {"start": prev_start_iso, "end": prev_end.isoformat()},
+        "total_spent": round(total_spent, 2),
+        "previous_total_spent": round(previous_total, 2),
+        "percent_change": round((total_spent - previous_total) / previous_total * 100, 2) if previous_total > 0 else 0,
+        "count": count,
+        "avg_transaction": round(total_spent / count, 2) if count else 0,
+        "top_categories": [
+            {
+                "name": row["name"],
+                "value": round(row["value"], 2),
+                "percent": round(row["value"] / total_spent * 100, 2) if total_spent > 0 else 0
+            }
+            for row in categories
+        ],
+        "largest_transactions": [dict(row) for row in largest],
+        "trend": [
+            {"key": key, "value": round(trend_values.get(key, 0), 2)}
+            for key in _bucket_keys(start, today, bucket)
+        ]
+    }
+
 class UpdateReceiptModel(BaseModel):
     merchant: Optional[str]
     date: Optional[str]
@@ -307,103 +2528,354 @@ class CreateReceiptModel(BaseModel):
     currency: str
     filename: str
     image_url: str
+    ocr_text: Optional[str] = None
 
 @app.post("/receipts")
 def create_receipt(data: CreateReceiptModel):
     receipt_id = str(uuid.uuid4())
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("""
-        INSERT INTO receipts (id, filename, merchant, date, total, tax, category, tax_rate, currency, status, image_url)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (receipt_id, data.filename, data.merchant, data.date, data.total, data.tax, data.category, data.tax_rate, data.currency, "Tamamlandı", data.image_url))
-    conn.commit()
-    conn.close()
+    with db_pool.connection() as conn:
+        conn.execute("""
+            INSERT INTO receipts (id, filename, merchant, date, total, tax, category, tax_rate, currency, status, image_url, total_minor, tax_minor, date_iso, ocr_text)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (receipt_id, data.filename, data.merchant, data.date, data.total, data.tax, data.category, data.tax_rate, data.currency, "Tamamlandı", data.image_url,
+              to_minor_units(data.total), to_minor_units(data.tax), to_iso_date(data.date), data.ocr_text))
+        apply_rollup_delta(conn, data.currency, data.category, to_iso_date(data.date), to_minor_units(data.total), 1)
     return {"status": "created", "id": receipt_id}
 
 @app.put("/receipts/{receipt_id}")
 def update_receipt(receipt_id: str, data: UpdateReceiptModel):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("""
-        UPDATE receipts 
-        SET merchant=?, date=?, total=?, tax=?, category=?, tax_rate=?, currency=?
-        WHERE id=?
-    """, (data.merchant, data.date, data.total, data.tax, data.category, data.tax_rate, data.currency, receipt_id))
-    conn.commit()
-    conn.close()
+    with db_pool.connection() as conn:
+        # Yazma kilidi eski satır okunmadan alınır; eşzamanlı güncellemeler aynı
+        # eski değeri iki kez düşüp özet tablolarını kaydırmasın
+        conn.execute("BEGIN IMMEDIATE")
+        old = conn.execute("SELECT currency, category, date_iso, total_minor FROM receipts WHERE id=?", (receipt_id,)).fetchone()
+        cursor = conn.execute("""
+            UPDATE receipts 
+            SET merchant=?, date=?, total=?, tax=?, category=?, tax_rate=?, currency=?, total_minor=?, tax_minor=?, date_iso=?
+            WHERE id=?
+        """, (data.merchant, data.date, data.total, data.tax, data.category, data.tax_rate, data.currency,
+              to_minor_units(data.total), to_minor_units(data.tax), to_iso_date(data.date), receipt_id))
+        if old is not None and cursor.rowcount == 1:
+            apply_rollup_delta(conn, old["currency"], old["category"], old["date_iso"], -(old["total_minor"] or 0), -1)
+            apply_rollup_delta(conn, data.currency, data.category, to_iso_date(data.date), to_minor_units(data.total), 1)
     return {"status": "updated"}
 
 @app.delete("/receipts/{receipt_id}")
 def delete_receipt(receipt_id: str):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT filename FROM receipts WHERE id=?", (receipt_id,))
-    row = c.fetchone()
-    if row:
+    with db_pool.connection() as conn:
+        c = conn.cursor()
+        # Aynı fişi silen eşzamanlı istekler özet tablolarından yalnızca bir kez düşsün
+        c.execute("BEGIN IMMEDIATE")
+        c.execute("SELECT filename, currency, category, date_iso, total_minor FROM receipts WHERE id=?", (receipt_id,))
+        row = c.fetchone()
+        c.execute("DELETE FROM receipts WHERE id=?", (receipt_id,))
+        if row is not None and c.rowcount == 1:
+            apply_rollup_delta(conn, row["currency"], row["category"], row["date_iso"], -(row["total_minor"] or 0), -1)
+
+    # Dosyayı commit'ten sonra sil, işlem geri alınırsa resim kaybolmasın
+    if row and row[0]:
         file_path = UPLOAD_DIR / row[0]
         if file_path.exists():
             os.remove(file_path)
-    
-    c.execute("DELETE FROM receipts WHERE id=?", (receipt_id,))
-    conn.commit()
-    conn.close()
     return {"status": "deleted"}
 
+async def read_upload(file):
+    # Dosyayı bir kez, parça parça oku; sınır aşılırsa tamamını belleğe almadan reddet
+    start = time.perf_counter()
+    digest = hashlib.sha256()
+    chunks = []
+    size = 0
+    while True:
+        chunk = await file.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > MAX_UPLOAD_BYTES:
+            raise HTTPException(status_code=413, detail=f"Upload exceeds {MAX_UPLOAD_BYTES} bytes")
+        digest.update(chunk)
+        chunks.append(chunk)
+    stage_seconds.observe(time.perf_counter() - start, stage="upload_read")
+    return b"".join(chunks), digest.hexdigest()
+
+def _new_upload_filename(file):
+    file_ext = file.filename.split('.')[-1]
+    unique_filename = f"{uuid.uuid4()}.{file_ext}"
+    return unique_filename, UPLOAD_DIR / unique_filename
+
+async def _process_batch_item(loop, original_filename, data, unique_filename, image_hash, save_future):
+    # OCR süreç havuzunda (CPU çekirdekleri), çıkarım ingest havuzunda çalışır
+    try:
+        # Disk isabeti SQLite okuma + last_hit_at yazımı yapar; event loop dışında çalışır
+        cached = await loop.run_in_executor(upload_io_executor, result_cache.get, image_hash)
+        if cached is not None:
+            structured_data, text = cached["structured_data"], cached["ocr_text"]
+        else:
+            # Süreç havuzundaki metrikler ana sürece ulaşmaz; süre buradan ölçülür (kuyruk dahil)
+            with stage_seconds.time(stage="ocr"):
+                text = await loop.run_in_executor(get_ocr_process_pool(), ocr_image_bytes, data)
+            structured_data = await loop.run_in_executor(ingest_executor, extract_structured_data, text, image_hash)
+        await asyncio.wrap_future(save_future)
+    except Exception as e:
+        print(f"HATA: {original_filename} işlenemedi: {e}")
+        return {"original_filename": original_filename, "status": "error", "error": str(e)}
+    return {
+        "original_filename": original_filename,
+        "status": "ok",
+        "filename": unique_filename,
+        "image_url": f"/static/{unique_filename}",
+        "structured_data": structured_data,
+        "ocr_text": text
+    }
+
+@app.post("/upload/batch")
+async def upload_receipts_batch(files: List[UploadFile] = File(...)):
+    # Toplam gövde sınırı UploadSizeLimitMiddleware'de, dosya başı sınır read_upload'da
+    if len(files) > MAX_BATCH_FILES:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_FILES} files per batch")
+    require_model_ready()
+
+    loop = asyncio.get_running_loop()
+    tasks = []
+    for file in files:
+        try:
+            data, image_hash = await read_upload(file)
+        except HTTPException as e:
+            tasks.append(asyncio.sleep(0, result={"original_filename": file.filename, "status": "error", "error": e.detail}))
+            continue
+        unique_filename, file_path = _new_upload_filename(file)
+        save_future = upload_io_executor.submit(write_upload, file_path, data)
+        tasks.append(_process_batch_item(loop, file.filename, data, unique_filename, image_hash, save_future))
+
+    results = await asyncio.gather(*tasks)
+    return {
+        "count": len(results),
+        "succeeded": sum(1 for r in results if r["status"] == "ok"),
+        "results": results
+    }
+
 @app.post("/upload")
-async def upload_receipt(file: UploadFile = File(...)):
+async def upload_receipt(request: Request, file: UploadFile = File(...), async_mode: bool = False):
     try:
-        # 1. Dosyayı Kaydet
-        file_ext = file.filename.split('.')[-1]
-        unique_filename = f"{uuid.uuid4()}.{file_ext}"
-        file_path = UPLOAD_DIR / unique_filename
-        
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-            
-        # Resim okuma (OCR için)
-        image = Image.open(file_path)
-        
-        # 2. OCR ve LLM
+        require_model_ready()
+        profile_trigger = profiling_trigger(request)
+        data, image_hash = await read_upload(file)
+
+        # 1. Dosyayı Kaydet (arka planda, OCR ile paralel)
+        unique_filename, file_path = _new_upload_filename(file)
+        save_future = upload_io_executor.submit(write_upload, file_path, data)
+
+        # Aynı görüntü daha önce işlendiyse OCR/LLM'i atla (SQLite araması event loop dışında)
+        loop = asyncio.get_running_loop()
+        cached = await loop.run_in_executor(upload_io_executor, result_cache.get, image_hash)
+        if cached is not None:
+            result = {
+                "filename": unique_filename,
+                "image_url": f"/static/{unique_filename}",
+                "structured_data": cached["structured_data"],
+                "ocr_text": cached["ocr_text"],
+                "cached": True
+            }
+            await asyncio.wrap_future(save_future)
+            if async_mode:
+                job_id = record_completed_job(unique_filename, result)
+                return {"job_id": job_id, "status": "done", "filename": unique_filename, "image_url": f"/static/{unique_filename}"}
+            return result
+
+        # 2. OCR ve LLM arka plandaki işçi havuzunda çalışır, event loop bloklanmaz
         try:
-            text = pytesseract.image_to_string(image, lang='eng')
-        except pytesseract.TesseractNotFoundError:
-            # Fallback for dev env without tesseract
-            print("HATA: Tesseract OCR bulunamadı! Mock modunda devam ediliyor.")
-            text = "MOCK RECEIPT TEXT"
-        except Exception as ocr_err:
-            print(f"HATA: OCR işlemi başarısız: {ocr_err}")
-            text = "MOCK RECEIPT TEXT"
-
-        data = process_with_llm(text)
-        
-        # 3. Veriyi Hazırla (DB'ye KAYDETME YOK)
-        merchant = data.get("merchant", "Bilinmiyor")
-        date = data.get("date", "")
-        # Clean amounts
-        total = clean_amount(data.get("total_amount", "0.00"))
-        tax = clean_amount(data.get("tax", "0.00"))
-        
-        tax_rate = data.get("tax_rate", "")
-        currency = clean_currency(data.get("currency", "₺"))
-        
-        return {
-            "filename": unique_filename,
-            "image_url": f"/static/{unique_filename}",
-            "structured_data": {
-                "merchant": merchant,
-                "date": date,
-                "total_amount": total,
-                "tax": tax,
-                "tax_rate": tax_rate,
-                "currency": currency
+            job_id, future = submit_ingest_job(data, unique_filename, image_hash, save_future, profile_trigger)
+        except HTTPException:
+            # Kuyruk dolu: yazılan dosyayı geride bırakma
+            save_future.add_done_callback(lambda _: file_path.unlink(missing_ok=True))
+            raise
+        if async_mode:
+            return {
+                "job_id": job_id,
+                "status": "queued",
+                "filename": unique_filename,
+                "image_url": f"/static/{unique_filename}"
             }
-        }
-        
+
+        return await asyncio.wrap_future(future)
+
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Hata: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/health/live")
+def health_live():
+    return {"status": "ok"}
+
+@app.get("/health/ready")
+def health_ready(response: Response):
+    ready = model_state["status"] in ("ready", "mock")
+    if not ready:
+        response.status_code = 503
+        if model_state["status"] == "loading":
+            response.headers["Retry-After"] = str(MODEL_RETRY_AFTER_SECONDS)
+    return {"ready": ready, "model": dict(model_state)}
+
+@app.get("/llm/stats")
+def get_llm_stats():
+    if llm_scheduler is None:
+        return {"model_loaded": False, "extraction_log": extraction_log.stats()}
+    stats = dict(llm_scheduler.stats)
+    stats["prefix_seconds_saved"] = round(stats["prefix_seconds_saved"], 3)
+    stats["avg_completion_tokens"] = round(stats["completion_tokens"] / stats["requests"], 2) if stats["requests"] else 0.0
+    return {
+        "model_loaded": True,
+        "pending": llm_scheduler.pending(),
+        "prefix_tokens": llm_scheduler.prefix_tokens,
+        "grammar": extraction_grammar is not None,
+        "prompt_lookup": getattr(llm, "draft_model", None) is not None,
+        **stats,
+        "instances": llm_scheduler.instance_stats(),
+        "extraction_log": extraction_log.stats()
+    }
+
+@app.get("/extraction/stats")
+def get_extraction_stats():
+    return extraction_paths.stats()
+
+@app.get("/cache/stats")
+def get_cache_stats():
+    return {"image": result_cache.stats(), "text": text_cache.stats()}
+
+@app.delete("/cache")
+def clear_cache():
+    result_cache.clear()
+    text_cache.clear()
+    return {"status": "cleared"}
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = get_job_snapshot(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+# --- DEBUG PROFILES ---
+def require_profiling_access(request):
+    # Profilleme kapalıyken bu uçlar hiç yokmuş gibi davranır
+    if not PROFILING_ENABLED and PROFILE_SAMPLE_RATE <= 0:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if PROFILING_TOKEN and request.headers.get("X-Spendify-Profile") != PROFILING_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid profiling token")
+
+@app.get("/debug/profiles")
+def list_profiles(request: Request):
+    require_profiling_access(request)
+    return {"profiles": profile_store.list(), "max_files": profile_store.max_files}
+
+@app.get("/debug/profiles/{profile_id}")
+def get_profile(
+    profile_id: str,
+    request: Request,
+    output: str = Query("text", alias="format", pattern="^(text|raw)$"),
+    sort: str = Query("cumulative"),
+    limit: int = Query(50, ge=1, le=1000)
+):
+    require_profiling_access(request)
+    if sort not in PROFILE_SORT_KEYS:
+        raise HTTPException(status_code=400, detail=f"sort must be one of {', '.join(PROFILE_SORT_KEYS)}")
+    path = profile_store.path_for(profile_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if output == "raw":
+        # pstats/snakeviz ile açılabilen ham cProfile çıktısı
+        return Response(
+            content=path.read_bytes(),
+            media_type="application/octet-stream",
+            headers={"Content-Disposition": f'attachment; filename="{profile_id}.prof"'}
+        )
+    return Response(content=profile_store.report(profile_id, sort, limit), media_type="text/plain; charset=utf-8")
+
+# --- METRICS ENDPOINT ---
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    # Router eşleşen rotayı aynı scope'a yazar; DB süreleri buradan uç noktaya bağlanır
+    token = current_request_scope.set(request.scope)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        current_request_scope.reset(token)
+        http_request_seconds.observe(
+            time.perf_counter() - start,
+            method=request.method,
+            route=getattr(request.scope.get("route"), "path", "unmatched"),
+            status=status
+        )
+
+@metrics.collector
+def collect_llm_metrics():
+    families = [
+        ("spendify_model_ready", "gauge", "1 when the model is loaded and warmed up (or mock mode is allowed).",
+         [({}, int(model_state["status"] in ("ready", "mock")))]),
+        ("spendify_model_load_seconds", "gauge", "Model load and warmup durations.",
+         [({"phase": phase}, model_state[f"{phase}_seconds"]) for phase in ("load", "warmup") if model_state[f"{phase}_seconds"] is not None])
+    ]
+    if llm_scheduler is None:
+        return families
+    stats = llm_scheduler.stats
+    return families + [
+        ("spendify_llm_tokens_total", "counter", "Prompt and generated tokens processed by the model.",
+         [({"kind": "prompt"}, stats["prompt_tokens"]), ({"kind": "completion"}, stats["completion_tokens"])]),
+        ("spendify_llm_requests_total", "counter", "Generations run by the LLM scheduler.", [({}, stats["requests"])]),
+        ("spendify_llm_batches_total", "counter", "Micro-batches run by the LLM scheduler.", [({}, stats["batches"])]),
+        ("spendify_llm_prefix_cache_total", "counter", "Requests whose prompt prefix was served from the KV cache.",
+         [({"result": "hit"}, stats["prefix_hits"]), ({"result": "miss"}, stats["prefix_misses"])]),
+        ("spendify_llm_prefix_restores_total", "counter", "Prompt prefix KV-state reloads after the prefix left the cache.",
+         [({}, stats["prefix_restores"])]),
+        ("spendify_llm_pending", "gauge", "Generations queued or running, per model instance.",
+         [({"instance": str(i)}, s.load()) for i, s in enumerate(llm_scheduler.schedulers)])
+    ]
+
+@metrics.collector
+def collect_pipeline_metrics():
+    image = result_cache.memory
+    text = text_cache.memory
+    with jobs_lock:
+        job_states = {}
+        for job in jobs.values():
+            job_states[job["status"]] = job_states.get(job["status"], 0) + 1
+    paths = extraction_paths.stats()
+    log = extraction_log.stats()
+    return [
+        # Bellekte bulunamayıp diskte bulunan da isabettir
+        ("spendify_cache_requests_total", "counter", "Result cache lookups by cache and outcome.", [
+            ({"cache": "image", "result": "hit"}, image.hits + result_cache.disk_hits),
+            ({"cache": "image", "result": "miss"}, image.misses - result_cache.disk_hits),
+            ({"cache": "text", "result": "hit"}, text.hits),
+            ({"cache": "text", "result": "miss"}, text.misses)
+        ]),
+        ("spendify_extractions_total", "counter", "Extractions by path (rule-based fast path or LLM).",
+         [({"path": path}, paths[path]) for path in ("rules", "llm")]),
+        ("spendify_ingest_jobs", "gauge", "Ingestion jobs currently tracked, by status.",
+         [({"status": status}, count) for status, count in job_states.items()]),
+        ("spendify_extraction_log_records_total", "counter", "Extraction log records by outcome.", [
+            ({"outcome": "queued"}, log["queued"]),
+            ({"outcome": "sampled_out"}, log["sampled_out"]),
+            ({"outcome": "dropped"}, log["dropped"])
+        ])
+    ]
+
+@app.get("/metrics")
+def get_metrics():
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 if __name__ == "__main__":
+    if sys.argv[1:] == ["rebuild-rollups"]:
+        # Toplam tablolarını receipts tablosundan baştan oluştur
+        with db_pool.connection() as conn:
+            rebuild_rollups(conn)
+        print("Rollup tables rebuilt.")
+        sys.exit(0)
+
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -3,8 +3,8 @@ import uuid
 import random
 import datetime
 
-# Database config
-DB_PATH = "receipts.db"
+# main import edildiğinde şema oluşturulur ve göçler uygulanır
+from main import DB_PATH, to_minor_units, to_iso_date, rebuild_rollups
 
 # Sample Data
 MERCHANTS = [
@@ -36,23 +36,6 @@ def seed_db():
     conn = sqlite3.connect(DB_PATH)
     c = conn.cursor()
 
-    # Create table if not exists (in case it's a fresh run)
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS receipts (
-            id TEXT PRIMARY KEY,
-            filename TEXT,
-            merchant TEXT,
-            date TEXT,
-            total TEXT,
-            tax TEXT,
-            category TEXT,
-            tax_rate TEXT,
-            status TEXT,
-            image_url TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
     # Generate 50 random receipts
     print("Generating 50 random receipts...")
     
@@ -78,14 +61,17 @@ def seed_db():
         image_url = "" # No real image
         
         receipts.append((
-            receipt_id, filename, merchant, date, total_str, tax_str, category, tax_rate_str, status, image_url
+            receipt_id, filename, merchant, date, total_str, tax_str, category, tax_rate_str, status, image_url,
+            to_minor_units(total_str), to_minor_units(tax_str), to_iso_date(date)
         ))
 
     c.executemany('''
-        INSERT INTO receipts (id, filename, merchant, date, total, tax, category, tax_rate, status, image_url)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        INSERT INTO receipts (id, filename, merchant, date, total, tax, category, tax_rate, status, image_url, total_minor, tax_minor, date_iso)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
     ''', receipts)
 
+    # Dashboard toplam tablolarını yeni kayıtlarla güncelle
+    rebuild_rollups(conn)
     conn.commit()
     print("Database seeded successfully!")
     conn.close()
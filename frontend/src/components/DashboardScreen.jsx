@@ -1,4 +1,4 @@
-import React, { useMemo, useState } from 'react';
+import React, { useEffect, useMemo, useState } from 'react';
 import {
     TrendingUp,
     Receipt,
@@ -22,6 +22,8 @@ import {
     Wallet
 } from 'lucide-react';
 
+const API_URL = "http://localhost:8000";
+
 export default function DashboardScreen({ transactions, onNavigateToScan }) {
     const [dateRange, setDateRange] = useState('30d'); // 30d, 3m, 6m, 1y
     const [currency, setCurrency] = useState('₺');
@@ -39,160 +41,67 @@ export default function DashboardScreen({ transactions, onNavigateToScan }) {
     const [hoveredPoint, setHoveredPoint] = useState(null); // { x, y, value, dateLabel }
     const [hoveredCategory, setHoveredCategory] = useState(null); // { name, percent, value }
 
-    // --- STATS CALCULATION ---
-    const stats = useMemo(() => {
-        const now = new Date();
-        now.setHours(23, 59, 59, 999); // End of today
-
-        // 1. Determine Start Date
-        const startDate = new Date();
-        if (dateRange === '30d') startDate.setDate(now.getDate() - 30);
-        else if (dateRange === '3m') startDate.setMonth(now.getMonth() - 3);
-        else if (dateRange === '6m') startDate.setMonth(now.getMonth() - 6);
-        else if (dateRange === '1y') startDate.setFullYear(now.getFullYear() - 1);
-        startDate.setHours(0, 0, 0, 0);
-
-        // 3. Filter Transactions (Date & Currency)
-        const filterFn = (t, start, end) => {
-            let d = new Date(t.date);
-            if (isNaN(d.getTime())) {
-                const parts = t.date.replace(/\//g, '.').split('.');
-                if (parts.length === 3) d = new Date(`${parts[2]}-${parts[1]}-${parts[0]}`);
-            }
-            // Check Currency (Default to ₺ if missing)
-            const tCurr = t.currency || '₺';
-            // Normalize symbols using simple logic if needed, but assuming strict match for now
-            // Allow matching symbols: '₺' matches 'TL', '$' matches 'USD' etc if needed.
-            // For now assume cleaner is doing its job.
-
-            return !isNaN(d.getTime()) && d >= start && d <= end && tCurr === currency;
-        };
-
-        const currentPeriodTransactions = transactions.filter(t => filterFn(t, startDate, now));
-
-        // Previous Period for Comparison
-        const prevStartDate = new Date(startDate);
-        const prevEndDate = new Date(startDate); // Comparison ends where current starts
-
-        let diffTime = now.getTime() - startDate.getTime();
-        prevStartDate.setTime(prevStartDate.getTime() - diffTime);
-
-        const prevPeriodTransactions = transactions.filter(t => filterFn(t, prevStartDate, prevEndDate));
-
-        // 4. Calculate Aggregates
-        let totalSpent = 0;
-        let prevTotalSpent = 0;
-        let totalCount = 0;
-        const categoryTotals = {};
-
-        currentPeriodTransactions.forEach(t => {
-            const amount = parseFloat(t.tot);
-            if (!isNaN(amount)) {
-                totalSpent += amount;
-                totalCount++;
-                const cat = t.cat || 'Other';
-                categoryTotals[cat] = (categoryTotals[cat] || 0) + amount;
-            }
-        });
-
-        prevPeriodTransactions.forEach(t => {
-            const amount = parseFloat(t.tot);
-            if (!isNaN(amount)) prevTotalSpent += amount;
-        });
+    // --- STATS (aggregated server-side by /stats) ---
+    const [serverStats, setServerStats] = useState(null);
+
+    useEffect(() => {
+        const controller = new AbortController();
+        const params = new URLSearchParams({ range: dateRange, currency });
+        fetch(`${API_URL}/stats?${params}`, { signal: controller.signal })
+            .then(res => {
+                if (!res.ok) throw new Error("Failed to fetch stats");
+                return res.json();
+            })
+            .then(setServerStats)
+            .catch(err => {
+                if (err.name !== 'AbortError') console.error(err);
+            });
+        return () => controller.abort();
+    }, [transactions, dateRange, currency]);
 
-        const percentChange = prevTotalSpent > 0 ? ((totalSpent - prevTotalSpent) / prevTotalSpent) * 100 : 0;
+    const stats = useMemo(() => {
         const currentLimit = budgetLimits[dateRange] || 10000;
-        const budgetProgress = Math.min((totalSpent / currentLimit) * 100, 100);
+        if (!serverStats) return { totalSpent: 0, prevTotalSpent: 0, percentChange: 0, budgetProgress: 0, avgTransaction: 0, projectedSavings: 0, topCategories: [], largestTransactions: [], trendPoints: "", areaPath: "", totalCount: 0, chartPoints: [], currentLimit };
 
-        const avgTransaction = totalCount > 0 ? totalSpent / totalCount : 0;
+        const totalSpent = serverStats.total_spent;
+        const budgetProgress = Math.min((totalSpent / currentLimit) * 100, 100);
 
-        // Top Categories (All sort desc)
-        // Top Categories (All sort desc)
+        // Pie chart needs cumulative start/end percentages
         let runningPercent = 0;
-        const topCategories = Object.entries(categoryTotals)
-            .sort(([, a], [, b]) => b - a)
-            .map(([name, value]) => {
-                const percent = totalSpent > 0 ? (value / totalSpent) * 100 : 0;
-                const startPercent = runningPercent;
-                runningPercent += percent;
-                return { name, value, percent, startPercent, endPercent: runningPercent };
-            });
+        const topCategories = serverStats.top_categories.map(({ name, value, percent }) => {
+            const startPercent = runningPercent;
+            runningPercent += percent;
+            return { name, value, percent, startPercent, endPercent: runningPercent };
+        });
 
-        // Largest Transactions
-        const largestTransactions = [...currentPeriodTransactions]
-            .sort((a, b) => parseFloat(b.tot) - parseFloat(a.tot))
-            .slice(0, 5);
-
-
-        // 4. Chart Data Preparation
-        let chartData = [];
-        let labels = [];
-
-        if (dateRange === '30d') {
-            // Daily Grouping
-            const daysMap = new Map();
-            // Init last 30 days with 0
-            for (let i = 0; i < 30; i++) {
-                const d = new Date();
-                d.setDate(now.getDate() - (29 - i));
-                const key = d.toISOString().split('T')[0]; // YYYY-MM-DD
-                daysMap.set(key, {
-                    val: 0,
+        const largestTransactions = serverStats.largest_transactions.map(t => ({
+            id: t.id,
+            merch: t.merchant,
+            date: t.date,
+            tot: t.total,
+            cat: t.category,
+            currency: t.currency
+        }));
+
+        // Chart Data Preparation (keys are YYYY-MM-DD or YYYY-MM)
+        const chartData = serverStats.trend.map(p => {
+            if (serverStats.bucket === 'day') {
+                const d = new Date(`${p.key}T00:00:00`);
+                return {
+                    val: p.value,
                     label: d.toLocaleDateString('en-US', { day: 'numeric', month: 'short' }),
                     fullDate: d.toLocaleDateString('en-US')
-                });
+                };
             }
+            const d = new Date(`${p.key}-01T00:00:00`);
+            return {
+                val: p.value,
+                label: d.toLocaleDateString('en-US', { month: 'short' }),
+                fullDate: d.toLocaleDateString('en-US', { month: 'long', year: 'numeric' })
+            };
+        });
 
-            currentPeriodTransactions.forEach(t => {
-                let d = new Date(t.date);
-                if (isNaN(d.getTime())) {
-                    const parts = t.date.replace(/\//g, '.').split('.');
-                    if (parts.length === 3) d = new Date(`${parts[2]}-${parts[1]}-${parts[0]}`);
-                }
-                const key = d.toISOString().split('T')[0];
-                if (daysMap.has(key)) {
-                    daysMap.get(key).val += parseFloat(t.tot) || 0;
-                }
-            });
-            chartData = Array.from(daysMap.values());
-
-        } else {
-            // Monthly Grouping
-            const monthMap = new Map();
-            let monthCount = dateRange === '3m' ? 3 : (dateRange === '6m' ? 6 : 12);
-
-            for (let i = 0; i < monthCount; i++) {
-                const d = new Date();
-                d.setMonth(now.getMonth() - (monthCount - 1 - i));
-                const key = `${d.getFullYear()}-${d.getMonth()}`;
-                monthMap.set(key, {
-                    val: 0,
-                    label: d.toLocaleDateString('en-US', { month: 'short' }),
-                    fullDate: d.toLocaleDateString('en-US', { month: 'long', year: 'numeric' })
-                });
-            }
-
-            currentPeriodTransactions.forEach(t => {
-                let d = new Date(t.date);
-                // Parsing fix
-                if (isNaN(d.getTime())) {
-                    const parts = t.date.replace(/\//g, '.').split('.');
-                    if (parts.length === 3) d = new Date(`${parts[2]}-${parts[1]}-${parts[0]}`);
-                }
-
-                if (!isNaN(d.getTime())) {
-                    const key = `${d.getFullYear()}-${d.getMonth()}`;
-                    if (monthMap.has(key)) {
-                        monthMap.get(key).val += parseFloat(t.tot) || 0;
-                    }
-                }
-            });
-            chartData = Array.from(monthMap.values());
-        }
-
-        // 5. Generate SVG Paths
-        if (chartData.length === 0) return { totalSpent, prevTotalSpent, percentChange, budgetProgress, avgTransaction, projectedSavings: 0, topCategories: [], largestTransactions: [], trendPoints: "", areaPath: "", totalCount: 0, chartData: [] };
-
+        // Generate SVG Paths
         const maxVal = Math.max(...chartData.map(d => d.val), 1);
         const points = chartData.map((d, idx) => {
             // Safe division
@@ -206,20 +115,20 @@ export default function DashboardScreen({ transactions, onNavigateToScan }) {
 
         return {
             totalSpent,
-            prevTotalSpent,
-            percentChange,
+            prevTotalSpent: serverStats.previous_total_spent,
+            percentChange: serverStats.percent_change,
             budgetProgress,
-            avgTransaction,
+            avgTransaction: serverStats.avg_transaction,
             projectedSavings: totalSpent * 0.1, // Mock logic
             topCategories,
             largestTransactions,
             trendPoints: trendPointsStr,
             areaPath: areaPathStr,
-            totalCount,
+            totalCount: serverStats.count,
             chartPoints: points,
-            currentLimit: budgetLimits[dateRange] || 10000
+            currentLimit
         };
-    }, [transactions, dateRange, currency, budgetLimits]);
+    }, [serverStats, dateRange, budgetLimits]);
 
     // HELPERS
     const getCategoryIcon = (cat) => {
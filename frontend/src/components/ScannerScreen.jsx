@@ -61,6 +61,7 @@ export default function ScannerScreen({ transactions, isLoading, onRefresh }) {
     // Temp states for new uploads before saving
     const [tempFilename, setTempFilename] = useState(null);
     const [tempImageUrl, setTempImageUrl] = useState(null);
+    const [tempOcrText, setTempOcrText] = useState(null);
 
     // --- GÖRSEL MODALI ---
     const [modalOpen, setModalOpen] = useState(false);
@@ -139,6 +140,7 @@ export default function ScannerScreen({ transactions, isLoading, onRefresh }) {
                 // Set temp file info
                 setTempFilename(data.filename);
                 setTempImageUrl(data.image_url);
+                setTempOcrText(data.ocr_text || null);
                 setActiveReceiptId(null); // It is a new receipt, not in DB yet
             }
             setStatus('analyzed');
@@ -181,7 +183,8 @@ export default function ScannerScreen({ transactions, isLoading, onRefresh }) {
                 const payload = {
                     merchant, date, total, tax, category, tax_rate: taxRate, currency,
                     filename: tempFilename,
-                    image_url: tempImageUrl
+                    image_url: tempImageUrl,
+                    ocr_text: tempOcrText
                 };
                 const res = await fetch(`${API_URL}/receipts`, {
                     method: 'POST',
@@ -196,6 +199,7 @@ export default function ScannerScreen({ transactions, isLoading, onRefresh }) {
             setFile(null);
             setTempFilename(null);
             setTempImageUrl(null);
+            setTempOcrText(null);
             setActiveReceiptId(null);
             onRefresh();
 